@@ -0,0 +1,178 @@
+"""
+Checks the batching node handler with local fake batch handlers.
+
+    python benchmarks/batching_check.py
+
+Covers the batch sizes, the flush after maxWaitMs, the results of every caller, the failure of a whole batch,
+cancelled calls and the thread pool of synchronous batch handlers. Exits with status 1 if a check fails.
+"""
+import asyncio, io, os, sys, threading, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from hablo.Config import YamlStreamConfiguration
+from hablo.Orchestrator import Orchestrator, BatchingNodeHandler
+
+
+FLOW = """
+inputs:
+  question: {type: str}
+nodes:
+""" + "".join(["""  n%d:
+    type: fake
+    prompt: "${inputs.question}"
+""" % i for i in range(6)]) + """outputs:
+  answer: ${nodes.n0.output}
+"""
+
+
+class _FakeContext:
+    def __init__(self, name : str):
+        self._name = name
+
+    def getName(self) -> str:
+        return self._name
+
+    def getType(self) -> str:
+        return "fake"
+
+    def getExecutor(self):
+        return None
+
+
+class _FakeBackend:
+    """
+    Records the batches it receives and answers every call with the name of its node.
+    """
+    def __init__(self, failing : bool = False):
+        self.batches = []
+        self.failing = failing
+
+    async def __call__(self, contexts : list) -> list:
+        self.batches.append([context.getName() for context in contexts])
+        if self.failing:
+            raise RuntimeError("backend failed")
+        return ["out:" + context.getName() for context in contexts]
+
+
+async def _callMany(handler : BatchingNodeHandler, count : int) -> list:
+    return await asyncio.gather(*[handler(_FakeContext("c" + str(i))) for i in range(count)], return_exceptions = True)
+
+
+def checkBatchSizes() -> bool:
+    """
+    Concurrent calls are split into full batches and one batch with the rest, every caller gets its own output.
+    """
+    backend = _FakeBackend()
+    handler = BatchingNodeHandler(backend, maxBatchSize = 4, maxWaitMs = 1000)
+    results = asyncio.run(_callMany(handler, 10))
+    ok = True
+    if [len(batch) for batch in backend.batches] != [4, 4, 2]:
+        print("batch sizes: expected [4, 4, 2] got " + str([len(batch) for batch in backend.batches]))
+        ok = False
+    if results != ["out:c" + str(i) for i in range(10)]:
+        print("batch sizes: the callers got the wrong outputs " + repr(results))
+        ok = False
+    statistics = handler.getStatistics()
+    if statistics["batches"] != 3 or statistics["fullBatches"] != 2 or statistics["queued"] != 0:
+        print("batch sizes: unexpected statistics " + repr(statistics))
+        ok = False
+    return ok
+
+
+def checkMaxWait() -> bool:
+    """
+    A batch that does not fill up is sent after maxWaitMs.
+    """
+    backend = _FakeBackend()
+    handler = BatchingNodeHandler(backend, maxBatchSize = 100, maxWaitMs = 50)
+    started = time.perf_counter()
+    results = asyncio.run(_callMany(handler, 3))
+    elapsed = time.perf_counter() - started
+    ok = True
+    if backend.batches != [["c0", "c1", "c2"]] or results != ["out:c0", "out:c1", "out:c2"]:
+        print("max wait: expected one batch of 3 calls got " + repr(backend.batches))
+        ok = False
+    if elapsed < 0.05 or elapsed > 1.0:
+        print("max wait: the batch was sent after " + str(round(elapsed, 3)) + " seconds instead of 0.05")
+        ok = False
+    return ok
+
+
+def checkFailure() -> bool:
+    """
+    If the batch handler fails, every call of the batch fails with its exception.
+    """
+    backend = _FakeBackend(failing = True)
+    handler = BatchingNodeHandler(backend, maxBatchSize = 3, maxWaitMs = 10)
+    results = asyncio.run(_callMany(handler, 3))
+    if not all([isinstance(result, RuntimeError) and str(result) == "backend failed" for result in results]):
+        print("failure: expected every call to fail got " + repr(results))
+        return False
+    return True
+
+
+def checkCancellation() -> bool:
+    """
+    Calls cancelled while they are queued are not sent to the batch handler.
+    """
+    backend = _FakeBackend()
+    handler = BatchingNodeHandler(backend, maxBatchSize = 100, maxWaitMs = 50)
+
+    async def _run():
+        tasks = [asyncio.ensure_future(handler(_FakeContext("c" + str(i)))) for i in range(3)]
+        await asyncio.sleep(0.01)
+        tasks[1].cancel()
+        return await asyncio.gather(*tasks, return_exceptions = True)
+
+    results = asyncio.run(_run())
+    ok = True
+    if backend.batches != [["c0", "c2"]]:
+        print("cancellation: expected the batch ['c0', 'c2'] got " + repr(backend.batches))
+        ok = False
+    if results[0] != "out:c0" or not isinstance(results[1], asyncio.CancelledError) or results[2] != "out:c2":
+        print("cancellation: unexpected results " + repr(results))
+        ok = False
+    if handler.getStatistics()["queued"] != 0:
+        print("cancellation: the cancelled call is still counted as queued")
+        ok = False
+    return ok
+
+
+def checkSyncHandler() -> bool:
+    """
+    Synchronous batch handlers run in the bounded thread pool of the orchestrator.
+    """
+    threads = []
+    def _backend(contexts : list) -> list:
+        threads.append(threading.current_thread().name)
+        return ["out:" + context.getName() for context in contexts]
+    orchestrator = Orchestrator(YamlStreamConfiguration(io.StringIO(FLOW)), maxThreads = 2)
+    orchestrator.setNodeHandler("fake", BatchingNodeHandler(_backend, maxBatchSize = 6, maxWaitMs = 50))
+    try:
+        answer = orchestrator.run({"question": "q"})["answer"]
+    finally:
+        orchestrator.close()
+    ok = True
+    if answer != "out:n0":
+        print("sync handler: expected 'out:n0' got " + repr(answer))
+        ok = False
+    if len(threads) != 1 or not threads[0].startswith("hablo-node"):
+        print("sync handler: expected one batch in the orchestrator thread pool got " + repr(threads))
+        ok = False
+    return ok
+
+
+def main():
+    ok = True
+    for check in (checkBatchSizes, checkMaxWait, checkFailure, checkCancellation, checkSyncHandler):
+        if check():
+            print(check.__name__ + " ok")
+        else:
+            ok = False
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Benchmarks loading, resolving, variable propagation, access and dumping of configurations.
+
+    python benchmarks/config_benchmark.py --nodes 1000 --output results.json
+    python benchmarks/config_benchmark.py --nodes 1000 --compare results.json
+
+The results are written as json, so runs of different commits can be compared.
+"""
+import argparse, copy, io, json, os, platform, statistics, subprocess, sys, tempfile, time
+import yaml
+from flow_generator import generateFlow, getSettingPath
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import hablo
+from hablo.Config import RootConfiguration, FileConfiguration, JsonStreamConfiguration, YamlStreamConfiguration
+from hablo.Config.config_base import VariableResolver
+
+
+class _DataConfiguration(RootConfiguration):
+    """
+    Wraps already parsed configuration data, so the resolver can be measured without parsing.
+    """
+    def __init__(self, configData):
+        self._configuration = configData
+
+    def reload(self):
+        pass
+
+
+def _measure(function, repeat : int, setup = None) -> dict:
+    timings = []
+    function(setup() if setup is not None else None) # warm up
+    for _ in range(repeat):
+        argument = setup() if setup is not None else None
+        t = time.perf_counter()
+        function(argument)
+        timings.append(time.perf_counter() - t)
+    return {
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.mean(timings),
+        "repeat": repeat
+    }
+
+
+def _getCommit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True, text = True, cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ""
+
+
+def runBenchmarks(inputs : int, nodes : int, fanout : int, depth : int, repeat : int) -> dict:
+    configData = generateFlow(inputs, nodes, fanout, depth)
+    yamlText = yaml.safe_dump(configData, sort_keys = False)
+    jsonText = json.dumps(configData)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "hablo.yaml")
+        with open(path, "w", encoding = "utf-8") as f:
+            f.write(yamlText)
+        results["load.file"] = _measure(lambda _: FileConfiguration(path), repeat)
+    results["load.yaml"] = _measure(lambda _: YamlStreamConfiguration(io.StringIO(yamlText)), repeat)
+    results["load.json"] = _measure(lambda _: JsonStreamConfiguration(io.StringIO(jsonText)), repeat)
+    results["resolve"] = _measure(lambda config: VariableResolver().resolve(config), repeat, lambda: _DataConfiguration(copy.deepcopy(configData)))
+
+    config = JsonStreamConfiguration(io.StringIO(jsonText))
+    resolver = config.getVariableResolver()
+    counter = [0]
+    def _setVariables(_):
+        counter[0] += 1
+        for i in range(inputs):
+            resolver.setVariable("inputs.in" + str(i), "changed " + str(counter[0]))
+    results["setVariable.inputs"] = _measure(_setVariables, repeat)
+    def _setOutputs(_):
+        counter[0] += 1
+        for n in range(nodes):
+            resolver.setVariable("nodes.n" + str(n) + ".output", "output " + str(counter[0]))
+    results["setVariable.outputs"] = _measure(_setOutputs, repeat)
+    results["resetVariables"] = _measure(lambda _: resolver.resetVariables(), repeat)
+
+    paths = [getSettingPath(n, depth) for n in range(nodes)]
+    def _getValues(_):
+        for p in paths:
+            config.getValue(p)
+    results["getValue"] = _measure(_getValues, repeat)
+    results["dump.yaml"] = _measure(lambda _: config.dump("yaml"), repeat)
+    results["dump.json"] = _measure(lambda _: config.dump("json"), repeat)
+
+    return {
+        "meta": {
+            "version": hablo.__version__,
+            "commit": _getCommit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "parameters": {"inputs": inputs, "nodes": nodes, "fanout": fanout, "depth": depth}
+        },
+        "results": results
+    }
+
+
+def compareResults(baseline : dict, current : dict, threshold : float) -> bool:
+    """
+    Prints the change of the median of every benchmark, returns False if one is slower than the threshold allows.
+    """
+    if baseline["meta"]["parameters"] != current["meta"]["parameters"]:
+        print("Warning: the runs used different parameters", file = sys.stderr)
+    ok = True
+    print("%-22s %12s %12s %8s" % ("benchmark", "baseline ms", "current ms", "change"))
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        before = baseline["results"][name]["median"]
+        after = result["median"]
+        change = (after - before) / before if before > 0 else 0.0
+        marker = ""
+        if change > threshold:
+            marker = " slower"
+            ok = False
+        print("%-22s %12.3f %12.3f %+7.1f%%%s" % (name, before * 1000, after * 1000, change * 100, marker))
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Benchmarks the configuration of hablo")
+    parser.add_argument("--inputs", type = int, default = 10, help = "number of flow inputs")
+    parser.add_argument("--nodes", type = int, default = 200, help = "number of nodes")
+    parser.add_argument("--fanout", type = int, default = 3, help = "variable references per node")
+    parser.add_argument("--depth", type = int, default = 3, help = "nesting depth of the node settings")
+    parser.add_argument("--repeat", type = int, default = 5, help = "repetitions of every benchmark")
+    parser.add_argument("--output", help = "writes the results to this json file")
+    parser.add_argument("--compare", help = "compares the results with this json file")
+    parser.add_argument("--threshold", type = float, default = 0.2, help = "allowed slowdown in comparisons (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    results = runBenchmarks(args.inputs, args.nodes, args.fanout, args.depth, args.repeat)
+    if args.output:
+        with open(args.output, "w", encoding = "utf-8") as f:
+            json.dump(results, f, indent = 2)
+    if args.compare:
+        with open(args.compare, "r", encoding = "utf-8") as f:
+            baseline = json.load(f)
+        if not compareResults(baseline, results, args.threshold):
+            sys.exit(1)
+    else:
+        for name, result in results["results"].items():
+            print("%-22s %10.3f ms" % (name, result["median"] * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""
+Generates synthetic flow configurations for the benchmarks.
+"""
+
+
+def generateFlow(inputs : int = 10, nodes : int = 100, fanout : int = 3, depth : int = 3) -> dict:
+    """
+    Returns the configuration data of a flow with the given number of inputs and nodes.
+    Every node references fanout variables (inputs and outputs of earlier nodes) in settings
+    that are nested depth levels deep. The flow output references the last node.
+    """
+    config = {"inputs": {}, "nodes": {}, "outputs": {}}
+    for i in range(inputs):
+        config["inputs"]["in" + str(i)] = {"type": "string", "default": "value " + str(i)}
+    for n in range(nodes):
+        variables = []
+        for f in range(fanout):
+            # the first reference is always an input, the others alternate between inputs and earlier nodes
+            source = (n * fanout + f) % (inputs + n) if f > 0 else n % inputs
+            if source < inputs:
+                variables.append("inputs.in" + str(source))
+            else:
+                variables.append("nodes.n" + str(source - inputs) + ".output")
+        settings = {
+            "prompt": "${" + variables[0] + "}",
+            "references": ["${" + variable + "}" for variable in variables],
+            "temperature": 0.5,
+            "labels": ["synthetic", "node " + str(n)]
+        }
+        for d in range(depth):
+            settings = {"level" + str(depth - d - 1): settings}
+        settings["type"] = "llm"
+        config["nodes"]["n" + str(n)] = settings
+    config["outputs"]["result"] = "${nodes.n" + str(nodes - 1) + ".output}"
+    return config
+
+
+def getSettingPath(node : int, depth : int = 3, key : str = "prompt") -> str:
+    """
+    Returns the configuration path of a setting of a generated node.
+    """
+    return ".".join(["nodes", "n" + str(node)] + ["level" + str(d) for d in range(depth)] + [key])
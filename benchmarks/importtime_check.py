@@ -0,0 +1,67 @@
+"""
+Checks the import time budget of hablo with python -X importtime.
+
+    python benchmarks/importtime_check.py
+
+Exits with status 1 if "import hablo" takes longer than the budget or if a module
+imports something it must only load lazily.
+"""
+import argparse, os, subprocess, sys
+
+SOURCE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+# module -> modules it must not import
+FORBIDDEN_IMPORTS = {
+    "hablo": ("yaml", "jinja2", "asyncio", "gunicorn", "hablo.Config", "hablo.Orchestrator", "hablo.Channels"),
+    "hablo.Config": ("yaml", "jinja2", "asyncio", "gunicorn"),
+    "hablo.Orchestrator": ("yaml", "jinja2", "gunicorn"),
+    "hablo.Channels": ("yaml", "jinja2", "gunicorn")
+}
+
+
+def measureImport(module : str) -> tuple:
+    """
+    Returns the cumulative import time of the module in microseconds and the names of all modules it imported.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = SOURCE_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import " + module], capture_output = True, text = True, env = env, check = True)
+    total = None
+    imported = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = [part.strip() for part in line[len("import time:"):].split("|")]
+        if not parts[1].isdigit():
+            continue
+        imported.add(parts[2])
+        if parts[2] == module:
+            total = int(parts[1])
+    return total, imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Checks the import time budget of hablo")
+    parser.add_argument("--budget", type = float, default = 10.0, help = "budget of \"import hablo\" in milliseconds")
+    parser.add_argument("--repeat", type = int, default = 5, help = "the fastest of this many imports is compared")
+    args = parser.parse_args()
+
+    ok = True
+    for module, forbidden in FORBIDDEN_IMPORTS.items():
+        total, imported = measureImport(module)
+        if module == "hablo":
+            for _ in range(args.repeat - 1):
+                total = min(total, measureImport(module)[0])
+        found = sorted([name for name in forbidden if name in imported])
+        print("%-26s %8.1f ms" % ("import " + module, total / 1000) + ("  imports " + ", ".join(found) if found else ""))
+        if found:
+            ok = False
+        if module == "hablo" and total / 1000 > args.budget:
+            print("import hablo exceeds the budget of " + str(args.budget) + " ms")
+            ok = False
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
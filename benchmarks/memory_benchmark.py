@@ -0,0 +1,62 @@
+"""
+Measures the memory retained by a loaded configuration per node.
+
+    python benchmarks/memory_benchmark.py --nodes 10000 --output memory.json
+"""
+import argparse, gc, io, json, os, sys, tracemalloc
+from flow_generator import generateFlow
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from hablo.Config import JsonStreamConfiguration
+from hablo.Orchestrator import getFlowPlan
+
+
+def measureConfiguration(inputs : int, nodes : int, fanout : int, depth : int) -> dict:
+    jsonText = json.dumps(generateFlow(inputs, nodes, fanout, depth))
+    # load once, so lazily imported modules and caches do not count
+    JsonStreamConfiguration(io.StringIO(jsonText))
+    # the stream keeps a copy of the source, it is created before measuring
+    stream = io.StringIO(jsonText)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    config = JsonStreamConfiguration(stream)
+    gc.collect()
+    loaded = tracemalloc.get_traced_memory()[0] - before
+    getFlowPlan(config)
+    config.getNativeConfiguration()
+    gc.collect()
+    warmed = tracemalloc.get_traced_memory()[0] - before
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return {
+        "parameters": {"inputs": inputs, "nodes": nodes, "fanout": fanout, "depth": depth},
+        "loadedBytes": loaded,
+        "loadedBytesPerNode": loaded / nodes,
+        "warmedBytes": warmed,
+        "warmedBytesPerNode": warmed / nodes,
+        "peakBytes": peak
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Measures the memory footprint of loaded configurations")
+    parser.add_argument("--inputs", type = int, default = 10, help = "number of flow inputs")
+    parser.add_argument("--nodes", type = int, default = 10000, help = "number of nodes")
+    parser.add_argument("--fanout", type = int, default = 3, help = "variable references per node")
+    parser.add_argument("--depth", type = int, default = 3, help = "nesting depth of the node settings")
+    parser.add_argument("--output", help = "writes the results to this json file")
+    args = parser.parse_args()
+
+    results = measureConfiguration(args.inputs, args.nodes, args.fanout, args.depth)
+    if args.output:
+        with open(args.output, "w", encoding = "utf-8") as f:
+            json.dump(results, f, indent = 2)
+    print("loaded: %10.0f bytes per node (%.1f MB)" % (results["loadedBytesPerNode"], results["loadedBytes"] / 1e6))
+    print("warmed: %10.0f bytes per node (%.1f MB, with flow plan and native dump)" % (results["warmedBytesPerNode"], results["warmedBytes"] / 1e6))
+    print("peak:   %10.1f MB" % (results["peakBytes"] / 1e6))
+
+
+if __name__ == "__main__":
+    main()
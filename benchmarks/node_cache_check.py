@@ -0,0 +1,115 @@
+"""
+Checks that cached node outputs are only reused for calls, that would produce the same output.
+
+    python benchmarks/node_cache_check.py
+
+Runs flows twice with different inputs and exits with status 1 if a cached output of the first run is returned by the second.
+"""
+import io, os, sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from hablo.Config import YamlStreamConfiguration
+from hablo.Orchestrator import Orchestrator, MemoryNodeCache
+
+
+TEMPLATE_FLOW = """
+inputs:
+  question: {type: str}
+nodes:
+  search:
+    type: search
+    query: ${inputs.question}
+  tmpl:
+    type: templ
+    cache: true
+    template: "Q={{ inputs.question }} S={{ nodes.search.output }}"
+outputs:
+  answer: ${nodes.tmpl.output}
+"""
+
+
+STREAMING_FLOW = """
+inputs:
+  question: {type: str}
+nodes:
+  search:
+    type: search
+    query: ${inputs.question}
+  answer:
+    type: llm
+    cache: true
+    prompt: ${nodes.search.output}
+outputs:
+  answer: ${nodes.answer.output}
+"""
+
+
+def _search(context):
+    return "S:" + str(context.getConfiguration()["query"])
+
+
+def _templ(context):
+    return context.renderTemplate()
+
+
+def checkTemplateNode() -> bool:
+    """
+    The variables a template reads are part of the cache key of its node.
+    """
+    orchestrator = Orchestrator(YamlStreamConfiguration(io.StringIO(TEMPLATE_FLOW)))
+    orchestrator.setNodeCache(MemoryNodeCache())
+    orchestrator.setNodeHandler("search", _search)
+    orchestrator.setNodeHandler("templ", _templ)
+    ok = True
+    for question in ("one", "two", "one"):
+        answer = orchestrator.run({"question": question})["answer"]
+        expected = "Q=" + question + " S=S:" + question
+        if answer != expected:
+            print("template node: expected " + repr(expected) + " got " + repr(answer))
+            ok = False
+    statistics = orchestrator.getNodeCache().getStatistics()
+    if statistics["hits"] != 1:
+        print("template node: expected 1 cache hit got " + str(statistics["hits"]))
+        ok = False
+    return ok
+
+
+async def _llm(context):
+    chunks = []
+    async for chunk in context.getInputStream("search"):
+        chunks.append(str(chunk))
+    return "A:" + "".join(chunks)
+
+
+def checkStreamingInputs() -> bool:
+    """
+    Nodes with streaming inputs start before their inputs are known, so they are not cached.
+    """
+    orchestrator = Orchestrator(YamlStreamConfiguration(io.StringIO(STREAMING_FLOW)))
+    orchestrator.setNodeCache(MemoryNodeCache())
+    orchestrator.setNodeHandler("search", _search)
+    orchestrator.setNodeHandler("llm", _llm, streamingInputs = True)
+    ok = True
+    for question in ("one", "two"):
+        answer = orchestrator.run({"question": question})["answer"]
+        expected = "A:S:" + question
+        if answer != expected:
+            print("streaming inputs: expected " + repr(expected) + " got " + repr(answer))
+            ok = False
+    return ok
+
+
+def main():
+    ok = True
+    for check in (checkTemplateNode, checkStreamingInputs):
+        if check():
+            print(check.__name__ + " ok")
+        else:
+            ok = False
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""
+Measures the boot time and the memory of forked workers with and without preloading the configuration.
+
+    python benchmarks/prefork_benchmark.py --nodes 5000 --workers 4 --output prefork.json
+
+The master forks the workers like gunicorn does and every worker answers requests through the WSGI application
+of the GunicornChannel, gunicorn itself is not needed. The modes are:
+  preload            the master loads hablo.yaml and runs GunicornChannel._preload() (with gc.freeze())
+  preload-nofreeze   like preload, but the frozen objects are unfrozen again before forking
+  per-worker         every worker loads hablo.yaml itself after it was forked
+The boot time is the time from the fork until the worker can serve requests, the first request time includes
+the work, that is done lazily by the first request (e.g. compiling the flow plan). The memory is read from
+/proc/self/smaps_rollup after the requests and a full garbage collection: the unique memory (USS) is what
+each additional worker costs, the proportional memory (PSS) includes its share of the pages shared with the master.
+"""
+import argparse, gc, io, json, os, subprocess, sys, tempfile, time
+from flow_generator import generateFlow
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+MODES = ("preload", "preload-nofreeze", "per-worker")
+
+
+def _readMemory() -> dict:
+    values = {}
+    with open("/proc/self/smaps_rollup", "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 2 and parts[0].endswith(":") and parts[1].isdigit():
+                values[parts[0][:-1]] = int(parts[1]) * 1024
+    return {
+        "uss": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+        "pss": values.get("Pss", 0),
+        "rss": values.get("Rss", 0)
+    }
+
+
+def _createChannel(configPath : str):
+    from hablo.Config import FileConfiguration
+    from hablo.Channels import GunicornChannel
+    channel = GunicornChannel()
+    channel.setConfiguration(FileConfiguration(configPath))
+    return channel
+
+
+def _request(channel) -> str:
+    body = b"{}"
+    environ = {"REQUEST_METHOD": "POST", "PATH_INFO": "/", "CONTENT_LENGTH": str(len(body)), "wsgi.input": io.BytesIO(body)}
+    statuses = []
+    response = b"".join(channel.application(environ, lambda status, headers, *args: statuses.append(status)))
+    if not statuses[0].startswith("200"):
+        raise RuntimeError("The request failed: " + response.decode("utf-8"))
+    return statuses[0]
+
+
+def _runWorker(mode : str, channel, configPath : str, forked : float, requests : int) -> dict:
+    if mode == "per-worker":
+        channel = _createChannel(configPath)
+    boot = time.perf_counter() - forked
+    started = time.perf_counter()
+    _request(channel)
+    firstRequest = time.perf_counter() - started
+    for _ in range(requests - 1):
+        _request(channel)
+    # long-running workers collect the old generation sooner or later, which touches every tracked object
+    gc.collect()
+    result = _readMemory()
+    result["bootSeconds"] = boot
+    result["firstRequestSeconds"] = firstRequest
+    return result
+
+
+def measureMode(mode : str, configPath : str, workers : int, requests : int) -> dict:
+    """
+    Runs the master of one mode in this process and returns the averages of its workers.
+    """
+    from hablo.Orchestrator import setGlobalNodeHandler
+    setGlobalNodeHandler("llm", lambda context: "output of " + context.getName())
+    channel = None
+    started = time.perf_counter()
+    if mode != "per-worker":
+        channel = _createChannel(configPath)
+        channel._preload()
+        if mode == "preload-nofreeze":
+            gc.unfreeze()
+    preload = time.perf_counter() - started
+    master = _readMemory()
+    pipes = []
+    for _ in range(workers):
+        readFd, writeFd = os.pipe()
+        forked = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            os.close(readFd)
+            try:
+                result = _runWorker(mode, channel, configPath, forked, requests)
+            except BaseException as e:
+                result = {"error": repr(e)}
+            with os.fdopen(writeFd, "w") as f:
+                json.dump(result, f)
+            os._exit(0)
+        os.close(writeFd)
+        pipes.append((pid, readFd))
+    results = []
+    for pid, readFd in pipes:
+        with os.fdopen(readFd, "r") as f:
+            results.append(json.load(f))
+        os.waitpid(pid, 0)
+    for result in results:
+        if "error" in result:
+            raise RuntimeError("A worker failed: " + result["error"])
+    summary = {"mode": mode, "workers": workers, "masterPreloadSeconds": preload, "masterRss": master["rss"]}
+    for key in ("bootSeconds", "firstRequestSeconds", "uss", "pss", "rss"):
+        summary[key] = sum([result[key] for result in results]) / len(results)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Measures forked workers with and without a preloaded configuration")
+    parser.add_argument("--nodes", type = int, default = 5000, help = "number of nodes of the generated hablo.yaml")
+    parser.add_argument("--depth", type = int, default = 3, help = "nesting depth of the node settings")
+    parser.add_argument("--workers", type = int, default = 4, help = "number of forked workers")
+    parser.add_argument("--requests", type = int, default = 3, help = "requests answered by every worker")
+    parser.add_argument("--mode", choices = MODES, help = "measures a single mode and prints its result as json")
+    parser.add_argument("--config", help = "the hablo.yaml to use instead of a generated one")
+    parser.add_argument("--output", help = "writes the results to this json file")
+    args = parser.parse_args()
+
+    if args.mode is not None:
+        print(json.dumps(measureMode(args.mode, args.config, args.workers, args.requests)))
+        return
+
+    import yaml
+    with tempfile.TemporaryDirectory() as directory:
+        configPath = os.path.join(directory, "hablo.yaml")
+        with open(configPath, "w", encoding = "utf-8") as f:
+            yaml.safe_dump(generateFlow(nodes = args.nodes, depth = args.depth), f)
+        results = []
+        for mode in MODES:
+            # every mode starts with a fresh master, so the modes do not share imported modules or caches
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), "--mode", mode, "--config", configPath,
+                "--workers", str(args.workers), "--requests", str(args.requests)], capture_output = True, text = True, check = True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+    if args.output:
+        with open(args.output, "w", encoding = "utf-8") as f:
+            json.dump(results, f, indent = 2)
+    print("%-18s %10s %14s %12s %12s %12s" % ("mode", "boot", "first request", "worker USS", "worker PSS", "master RSS"))
+    for result in results:
+        print("%-18s %8.3f s %12.3f s %9.1f MB %9.1f MB %9.1f MB" % (result["mode"], result["bootSeconds"], result["firstRequestSeconds"], result["uss"] / 1e6, result["pss"] / 1e6, result["masterRss"] / 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,15 @@
+import asyncio, gc, itertools, json, os, sys, threading, time
 from abc import ABC, abstractmethod
+from typing import Tuple, Union
 from ..Config import RootConfiguration
+from ..Orchestrator import Orchestrator, NodeExecutionError, AdmissionRejectedError, getFlowPlan, getBatchingStatistics
+from ..Instrumentation import PrometheusSink, addSink, getSinks, startSpan, endSpan
 
 class Channel(ABC):
     _configuration : RootConfiguration = None
     _flow_orchestrator = None
+    _threadLocal = threading.local()
+    _settingsPath = "channels"
 
     def setConfiguration(self, configuration : RootConfiguration):
         self._configuration = configuration
@@ -11,19 +17,438 @@ class Channel(ABC):
     def setFlowOrchestrator(self, flow_orchestrator):
         self._flow_orchestrator = flow_orchestrator
 
+    def _getFlowOrchestrator(self) -> Orchestrator:
+        if self._flow_orchestrator is None:
+            self._flow_orchestrator = Orchestrator(self._configuration)
+        return self._flow_orchestrator
+
+    def _getSetting(self, key : str, default):
+        """
+        Returns a setting of the channel from the configuration (e.g. channels.gunicorn.workers).
+        """
+        path = self._settingsPath + "." + key
+        if self._configuration is not None and self._configuration.pathExists(path):
+            return self._configuration.getValue(path)
+        return default
+
+    def _getEventLoop(self) -> asyncio.AbstractEventLoop:
+        """
+        Returns the event loop of the current thread, channels serve requests from synchronous code.
+        """
+        loop = getattr(self._threadLocal, "loop", None)
+        if loop is None or loop.is_closed():
+            loop = asyncio.new_event_loop()
+            self._threadLocal.loop = loop
+        return loop
+
+    def _runSync(self, coroutine):
+        return self._getEventLoop().run_until_complete(coroutine)
+
+    def _iterateSync(self, asyncIterator):
+        """
+        Iterates an async generator from synchronous code, every item is returned as soon as it is produced.
+        """
+        loop = self._getEventLoop()
+        try:
+            while True:
+                try:
+                    item = loop.run_until_complete(asyncIterator.__anext__())
+                except StopAsyncIteration:
+                    return
+                yield item
+        finally:
+            loop.run_until_complete(asyncIterator.aclose())
+
     @abstractmethod
     def run(self):
         raise NotImplementedError("Subclasses must implement this method")
 
 
 class ConsoleChannel(Channel):
+    """
+    Reads one request per line from stdin and writes the flow output to stdout as it is produced.
+    A line is either a json object with the flow inputs or, for flows with a single input, the value of that input.
+    If channels.console.batch.input and channels.console.batch.output are configured, the channel runs in batch mode instead.
+    With channels.console.session the lines are the turns of one conversation, that only re-run the nodes affected by changed inputs.
+    """
+    _settingsPath = "channels.console"
+
+    def _parseInputs(self, line : str) -> dict:
+        if line.startswith("{"):
+            return json.loads(line)
+        inputs = self._getFlowOrchestrator().getPlan().getInputs()
+        if len(inputs) != 1:
+            raise ValueError("The flow has several inputs, please pass them as json object")
+        return { inputs[0]: line }
+
     def run(self):
+        batchInput = self._getSetting("batch.input", None)
+        batchOutput = self._getSetting("batch.output", None)
+        if batchInput is not None and batchOutput is not None:
+            self.runBatch(str(batchInput), str(batchOutput))
+            return
         print("Console is running")
+        orchestrator = self._getFlowOrchestrator()
+        if self._getSetting("session", False):
+            orchestrator = orchestrator.createSession()
+        for line in sys.stdin:
+            line = line.strip()
+            if line == "":
+                continue
+            span = startSpan("channel.request", {"channel": "console"})
+            try:
+                streamed = False
+                for event in self._iterateSync(orchestrator.streamAsync(self._parseInputs(line))):
+                    if "chunk" in event:
+                        streamed = True
+                        sys.stdout.write(str(event["chunk"]))
+                        sys.stdout.flush()
+                    elif streamed:
+                        sys.stdout.write("\n")
+                        sys.stdout.flush()
+                    else:
+                        print(json.dumps(event["outputs"]), flush = True)
+            except (ValueError, NodeExecutionError, AdmissionRejectedError) as e:
+                endSpan(span, e)
+                print("Error: " + str(e), file = sys.stderr, flush = True)
+                continue
+            endSpan(span)
+
+    def _readCheckpoint(self, outputPath : str) -> set:
+        """
+        Returns the indices of the records already written to the output file without an error.
+        A partially written last line is cut off and the error lines are removed, so the failed records
+        are retried and the file can be appended to.
+        """
+        done = set()
+        if not os.path.exists(outputPath):
+            return done
+        validLength = 0
+        failed = 0
+        with open(outputPath, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                    index = int(record["index"])
+                except (ValueError, KeyError, TypeError):
+                    break
+                validLength += len(line)
+                if "error" in record:
+                    failed += 1
+                else:
+                    done.add(index)
+        if failed > 0:
+            tmpPath = outputPath + ".tmp"
+            with open(outputPath, "rb") as f, open(tmpPath, "wb") as output:
+                remaining = validLength
+                for line in f:
+                    if remaining <= 0:
+                        break
+                    remaining -= len(line)
+                    if "error" not in json.loads(line):
+                        output.write(line)
+            os.replace(tmpPath, outputPath)
+        elif validLength != os.path.getsize(outputPath):
+            with open(outputPath, "rb+") as f:
+                f.truncate(validLength)
+        return done
+
+    async def _runAdmitted(self, inputs : dict) -> dict:
+        """
+        Runs the flow and retries with back-off while the scheduler rejects the run because its queue is full,
+        a batch waits for room instead of dropping records.
+        """
+        delay = 0.01
+        while True:
+            try:
+                return await self._getFlowOrchestrator().runAsync(inputs)
+            except AdmissionRejectedError as e:
+                if e.getRetryAfter() is None:
+                    raise
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, e.getRetryAfter())
+
+    async def _processRecord(self, index : int, line : str) -> Tuple[str, bool]:
+        """
+        Runs the flow for one input record and returns its result line and whether it failed.
+        Outputs, that cannot be serialized to json, are reported as an error of the record.
+        """
+        span = startSpan("channel.request", {"channel": "console", "batch": True})
+        try:
+            inputs = json.loads(line)
+            if not isinstance(inputs, dict):
+                raise ValueError("The record must be a json object")
+            result = json.dumps({"index": index, "outputs": await self._runAdmitted(inputs)})
+        except (ValueError, TypeError, NodeExecutionError, AdmissionRejectedError) as e:
+            endSpan(span, e)
+            return json.dumps({"index": index, "error": str(e)}), True
+        endSpan(span)
+        return result, False
+
+    async def runBatchAsync(self, inputPath : str, outputPath : str, concurrency : int = 16, resume : bool = True, reportInterval : float = 10.0) -> dict:
+        """
+        Runs the flow for every json object in the input jsonl file and appends one result line per record
+        ({"index": ..., "outputs": ...} or {"index": ..., "error": ...}) to the output jsonl file.
+        At most concurrency records are processed at the same time and only a bounded number of records is read ahead.
+        With resume, records that are already in the output file are skipped, so an interrupted batch can be continued,
+        records that failed are retried and their error lines are replaced.
+        Returns the number of processed, skipped and failed records and the throughput.
+        """
+        done = self._readCheckpoint(outputPath) if resume else set()
+        queue = asyncio.Queue(maxsize = concurrency * 2)
+        stats = {"records": 0, "skipped": 0, "failed": 0}
+        started = time.perf_counter()
+        lastReport = [started]
+
+        async def _read():
+            with open(inputPath, "r", encoding = "utf-8") as f:
+                index = 0
+                for line in f:
+                    line = line.strip()
+                    if line == "":
+                        continue
+                    if index in done:
+                        stats["skipped"] += 1
+                    else:
+                        await queue.put((index, line))
+                    index += 1
+            for _ in range(concurrency):
+                await queue.put(None)
+
+        async def _work(output):
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                result, failed = await self._processRecord(item[0], item[1])
+                output.write(result + "\n")
+                stats["records"] += 1
+                if failed:
+                    stats["failed"] += 1
+                now = time.perf_counter()
+                if now - lastReport[0] >= reportInterval:
+                    lastReport[0] = now
+                    output.flush()
+                    print("Processed " + str(stats["records"]) + " records (" + str(round(stats["records"] / (now - started), 1)) + " records/s)", file = sys.stderr, flush = True)
+
+        with open(outputPath, "a" if resume else "w", encoding = "utf-8") as output:
+            tasks = [asyncio.ensure_future(_read())] + [asyncio.ensure_future(_work(output)) for _ in range(concurrency)]
+            try:
+                await asyncio.gather(*tasks)
+            except BaseException:
+                # the other workers must not outlive the batch and its event loop
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions = True)
+                raise
+        seconds = time.perf_counter() - started
+        stats["seconds"] = seconds
+        stats["recordsPerSecond"] = stats["records"] / seconds if seconds > 0 else 0.0
+        return stats
+
+    def runBatch(self, inputPath : str, outputPath : str, concurrency : Union[int, None] = None, resume : bool = True) -> dict:
+        """
+        Synchronous version of runBatchAsync(), concurrency defaults to channels.console.batch.concurrency.
+        """
+        if concurrency is None:
+            concurrency = int(self._getSetting("batch.concurrency", 16))
+        stats = self._runSync(self.runBatchAsync(inputPath, outputPath, concurrency, resume))
+        print("Processed " + str(stats["records"]) + " records in " + str(round(stats["seconds"], 2)) + " seconds (" + str(round(stats["recordsPerSecond"], 1)) + " records/s, " + str(stats["skipped"]) + " skipped, " + str(stats["failed"]) + " failed)", file = sys.stderr, flush = True)
+        return stats
+
 
 class GunicornChannel(Channel):
+    """
+    Serves the flow over http, POST the flow inputs as json object.
+    Clients accepting text/event-stream receive the output as server-sent events while it is produced.
+    If channels.gunicorn.metrics is enabled, the instrumentation metrics are served at GET /metrics.
+    With a scheduler section in the configuration, requests are admitted by their X-Hablo-Priority header (higher first)
+    and X-Hablo-Deadline-Ms header (the milliseconds the client waits), rejected requests get 503 with Retry-After.
+    """
+    _settingsPath = "channels.gunicorn"
+
+    def _respond(self, start_response, status : str, data : dict, headers : Union[list, None] = None):
+        body = json.dumps(data).encode("utf-8")
+        start_response(status, [("Content-Type", "application/json"), ("Content-Length", str(len(body)))] + (headers or []))
+        return [body]
+
+    def _respondRejected(self, start_response, error : AdmissionRejectedError):
+        if error.getRetryAfter() is None:
+            return self._respond(start_response, "503 Service Unavailable", {"error": str(error)})
+        retryAfter = str(max(1, int(error.getRetryAfter() + 0.999)))
+        return self._respond(start_response, "503 Service Unavailable", {"error": str(error)}, [("Retry-After", retryAfter)])
+
+    def _getAdmission(self, environ) -> tuple:
+        """
+        Returns the priority and the deadline (a time.monotonic() timestamp) of a request from its headers.
+        """
+        try:
+            priority = int(environ.get("HTTP_X_HABLO_PRIORITY") or 0)
+        except ValueError:
+            raise ValueError("X-Hablo-Priority must be an integer") from None
+        deadline = None
+        if environ.get("HTTP_X_HABLO_DEADLINE_MS"):
+            try:
+                deadline = time.monotonic() + float(environ["HTTP_X_HABLO_DEADLINE_MS"]) / 1000.0
+            except ValueError:
+                raise ValueError("X-Hablo-Deadline-Ms must be a number") from None
+        return priority, deadline
+
+    def _streamEvents(self, events, error : Union[Exception, None] = None):
+        try:
+            if error is not None:
+                raise error
+            for event in events:
+                name = "chunk" if "chunk" in event else "outputs"
+                yield ("event: " + name + "\ndata: " + json.dumps(event) + "\n\n").encode("utf-8")
+        except (ValueError, NodeExecutionError) as e:
+            yield ("event: error\ndata: " + json.dumps({"error": str(e)}) + "\n\n").encode("utf-8")
+
+    def _getMetricsSink(self) -> Union[PrometheusSink, None]:
+        for sink in getSinks():
+            if isinstance(sink, PrometheusSink):
+                return sink
+        return None
+
+    def enableMetrics(self) -> PrometheusSink:
+        """
+        Registers a PrometheusSink (unless one is registered already), that also reports the cache and batching statistics.
+        """
+        sink = self._getMetricsSink()
+        if sink is None:
+            sink = PrometheusSink()
+            addSink(sink)
+        orchestrator = self._getFlowOrchestrator()
+        sink.addCollector("configuration_access_cache", lambda: orchestrator.getConfiguration().getAccessStatistics(), "Statistics of the configuration access cache.")
+        sink.addCollector("node_cache", lambda: orchestrator.getNodeCache().getStatistics() if orchestrator.getNodeCache() is not None else {}, "Statistics of the node output cache.")
+        sink.addCollector("node_batching", getBatchingStatistics, "Queue depth and batch sizes of the batching node handlers.")
+        sink.addCollector("scheduler", lambda: orchestrator.getScheduler().getStatistics() if orchestrator.getScheduler() is not None else {}, "Statistics of the admission scheduler.")
+        return sink
+
+    def _respondMetrics(self, start_response):
+        sink = self._getMetricsSink()
+        if sink is None:
+            return self._respond(start_response, "404 Not Found", {"error": "Metrics are not enabled"})
+        body = sink.render().encode("utf-8")
+        start_response("200 OK", [("Content-Type", "text/plain; version=0.0.4; charset=utf-8"), ("Content-Length", str(len(body)))])
+        return [body]
+
+    def _endSpanAfter(self, iterable, span):
+        try:
+            yield from iterable
+        finally:
+            endSpan(span)
+
+    def application(self, environ, start_response):
+        """
+        The WSGI application of the channel.
+        """
+        span = startSpan("channel.request", {"channel": "gunicorn", "method": environ.get("REQUEST_METHOD")})
+        if span is None:
+            return self._handle(environ, start_response)
+        def _startResponse(status, headers, *args):
+            span.setAttribute("status", status.split(" ")[0])
+            return start_response(status, headers, *args)
+        try:
+            result = self._handle(environ, _startResponse)
+        except BaseException as e:
+            endSpan(span, e)
+            raise
+        if isinstance(result, list):
+            endSpan(span)
+            return result
+        # streamed responses are finished when the server has consumed them
+        return self._endSpanAfter(result, span)
+
+    def _handle(self, environ, start_response):
+        if environ.get("REQUEST_METHOD") == "GET" and environ.get("PATH_INFO") == "/metrics":
+            return self._respondMetrics(start_response)
+        if environ.get("REQUEST_METHOD") != "POST":
+            return self._respond(start_response, "405 Method Not Allowed", {"error": "Only POST requests are supported"})
+        try:
+            length = int(environ.get("CONTENT_LENGTH") or 0)
+            body = environ["wsgi.input"].read(length) if length > 0 else b""
+            inputs = json.loads(body) if body else {}
+            if not isinstance(inputs, dict):
+                raise ValueError("The request body must be a json object")
+            priority, deadline = self._getAdmission(environ)
+        except ValueError as e:
+            return self._respond(start_response, "400 Bad Request", {"error": str(e)})
+        if "text/event-stream" in environ.get("HTTP_ACCEPT", ""):
+            events = self._iterateSync(self._getFlowOrchestrator().streamAsync(inputs, priority, deadline))
+            # the first event is read before the response starts, so rejected requests still get a 503
+            error = None
+            try:
+                events = itertools.chain([next(events)], events)
+            except StopIteration:
+                events = iter(())
+            except AdmissionRejectedError as e:
+                return self._respondRejected(start_response, e)
+            except (ValueError, NodeExecutionError) as e:
+                error = e
+            start_response("200 OK", [("Content-Type", "text/event-stream"), ("Cache-Control", "no-cache"), ("X-Accel-Buffering", "no")])
+            return self._streamEvents(events, error)
+        try:
+            outputs = self._runSync(self._getFlowOrchestrator().runAsync(inputs, priority, deadline))
+        except AdmissionRejectedError as e:
+            return self._respondRejected(start_response, e)
+        except ValueError as e:
+            return self._respond(start_response, "400 Bad Request", {"error": str(e)})
+        except NodeExecutionError as e:
+            return self._respond(start_response, "500 Internal Server Error", {"error": str(e)})
+        return self._respond(start_response, "200 OK", {"outputs": outputs})
+
+    def getOptions(self) -> dict:
+        """
+        Returns the gunicorn settings, that are read from channels.gunicorn in the configuration.
+        """
+        threads = int(self._getSetting("threads", 4))
+        return {
+            "bind": str(self._getSetting("bind", "127.0.0.1:8000")),
+            "workers": int(self._getSetting("workers", (os.cpu_count() or 1) * 2 + 1)),
+            "threads": threads,
+            "worker_class": "gthread" if threads > 1 else "sync",
+            "keepalive": int(self._getSetting("keepalive", 5)),
+            "timeout": int(self._getSetting("timeout", 120)),
+            "preload_app": True
+        }
+
+    def _preload(self):
+        """
+        Loads everything that is shared by the workers in the master, before the workers are forked.
+        The long-lived objects are frozen, so the garbage collector does not touch their pages in the
+        workers and the copy-on-write pages stay shared.
+        """
+        orchestrator = self._getFlowOrchestrator()
+        if self._getSetting("metrics", False):
+            self.enableMetrics()
+        getFlowPlan(orchestrator.getConfiguration())
+        from ..Templates import getNodeTemplates
+        getNodeTemplates(orchestrator.getConfiguration())
+        orchestrator.getConfiguration().getNativeConfiguration()
+        gc.collect()
+        gc.freeze()
+        return self.application
+
     def run(self):
+        try:
+            from gunicorn.app.base import BaseApplication
+        except ImportError:
+            raise ImportError("The GunicornChannel requires gunicorn, please install it with: pip install hablo[gunicorn]") from None
+
+        channel = self
+        class _HabloApplication(BaseApplication):
+            def load_config(self):
+                for key, value in channel.getOptions().items():
+                    self.cfg.set(key, value)
+
+            def load(self):
+                return channel._preload()
+
         print("Gunicorn is running")
+        _HabloApplication().run()
 
 
 __all__ = ['Channel', 'GunicornChannel', 'ConsoleChannel']
-
@@ -1,3 +1,4 @@
-from .config_base import BaseConfiguration, RootConfiguration, FileConfiguration, JsonStreamConfiguration, YamlStreamConfiguration, ConfigurationKeyError, ConfigurationValueError
+from .config_base import BaseConfiguration, RootConfiguration, FileConfiguration, JsonStreamConfiguration, YamlStreamConfiguration, ConfigurationKeyError, ConfigurationValueError, ConfigurationPath, VariableScope
+from .config_cache import CompiledConfigurationCache
 
-__all__ = ['BaseConfiguration', 'RootConfiguration', 'FileConfiguration', 'JsonStreamConfiguration', 'YamlStreamConfiguration', 'ConfigurationKeyError', 'ConfigurationValueError']
+__all__ = ['BaseConfiguration', 'RootConfiguration', 'FileConfiguration', 'JsonStreamConfiguration', 'YamlStreamConfiguration', 'ConfigurationKeyError', 'ConfigurationValueError', 'ConfigurationPath', 'VariableScope', 'CompiledConfigurationCache']
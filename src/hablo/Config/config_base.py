@@ -1,10 +1,36 @@
-import json, yaml, io, logging
-from typing import Union, List
+import json, io, os, sys, time, logging, threading, hashlib, itertools
+from typing import Union, List, Tuple
 from abc import ABC, abstractmethod
+from ..Instrumentation import startSpan, endSpan
 
 
 habloLogger = logging.getLogger("hablo.Config")
 
+# pyyaml is imported when the first yaml configuration is loaded or dumped, json only configurations never pay for it
+_yaml = None
+def _getYaml():
+    global _yaml, _YamlSafeLoader, _YamlDumper
+    if _yaml is None:
+        import yaml
+
+        class _YamlDumper(yaml.Dumper):
+            """
+            Writes shared subtrees out in full instead of as anchors and aliases.
+            """
+            def ignore_aliases(self, data):
+                return True
+
+        # use the libyaml based loader if pyyaml was built with it
+        _YamlSafeLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+        _yaml = yaml
+    return _yaml
+
+def _loadYaml(content):
+    return _getYaml().load(content, Loader = _YamlSafeLoader)
+
+def _dumpYaml(data) -> str:
+    return _getYaml().dump(data, Dumper = _YamlDumper)
+
 
 class ConfigurationKeyError(KeyError):
     pass
@@ -14,10 +40,10 @@ class ConfigurationValueError(ValueError):
 
 
 class ConfigurationVariableReference:
-    _variableName : str = ""
-    _value = None
+    __slots__ = ("_variableName", "_value")
+
     def __init__(self, variableName : str = "", value = None):
-        self._variableName = variableName
+        self._variableName = sys.intern(variableName)
         self._value = value
     
     def getName(self):
@@ -29,28 +55,117 @@ class ConfigurationVariableReference:
     def getValue(self):
         return self._value
 
+class ConfigurationReferenceTrie:
+    """
+    Indexes the references of a variable by their key path below the variable,
+    so that references sharing a prefix walk the value only once.
+    """
+    __slots__ = ("references", "children")
+
+    def __init__(self):
+        # most nodes of a trie are leaves, so the containers are only created when needed
+        self.references = ()
+        self.children = None
+
+    def getChild(self, key : str, create : bool = False) -> Union["ConfigurationReferenceTrie", None]:
+        child = None if self.children is None else self.children.get(key)
+        if child is None and create:
+            child = ConfigurationReferenceTrie()
+            if self.children is None:
+                self.children = {}
+            self.children[key] = child
+        return child
+
+    def addReference(self, reference : ConfigurationVariableReference):
+        self.references = self.references + (reference,)
+
+    def removeReference(self, reference : ConfigurationVariableReference):
+        references = list(self.references)
+        references.remove(reference)
+        self.references = tuple(references)
+
+    def collectReferences(self, references : list):
+        references.extend(self.references)
+        if self.children is not None:
+            for child in self.children.values():
+                child.collectReferences(references)
+
+    def collectValues(self, value, values : list, isResetting : bool):
+        for ref in self.references:
+            values.append((ref, value))
+        self.collectChildValues(value, values, isResetting)
+
+    def collectChildValues(self, value, values : list, isResetting : bool):
+        if self.children is None:
+            return
+        for key, child in self.children.items():
+            try:
+                v = value[key]
+            except:
+                failed = []
+                child.collectReferences(failed)
+                for ref in failed:
+                    if not isResetting:
+                        habloLogger.warning("Failed to set variable reference: " + ref.getName())
+                    values.append((ref, None))
+                continue
+            child.collectValues(v, values, isResetting)
+
+
+# numbers the value changes of all variables, so dump caches only look for changed variables after a change
+_variableChanges = itertools.count(1)
+_lastVariableChange = 0
+
 class ConfigurationVariable:
-    _variableName : str = ""
-    _value = None
-    _defaultValue = None
-    _typeDef = None
-    _references = []
-    _isResetting = False
+    __slots__ = ("_variableName", "_value", "_rawValue", "_defaultValue", "_typeDef", "_isResetting", "_version", "_references", "_referenceTrie", "_unmatchedReferences")
+
     def __init__(self, variableName : str = "", defaultValue = None, typeDef = None):
-        self._isReset = False
+        self._isResetting = False
+        self._version = 0
         self._references = []
-        self._variableName = variableName
+        self._referenceTrie = ConfigurationReferenceTrie()
+        self._unmatchedReferences = ()
+        self._variableName = sys.intern(variableName)
         self._value = defaultValue
+        self._rawValue = defaultValue
         self._defaultValue = defaultValue
         if typeDef is None:
             self._typeDef = None
         else:
             self._typeDef = str(typeDef).lower().strip()
     
+    def _getReferenceTrie(self, reference : ConfigurationVariableReference, create : bool = False) -> Union[ConfigurationReferenceTrie, None]:
+        """
+        Returns the trie node holding the reference, or None if the reference is not below this variable.
+        """
+        name = reference.getName()
+        if name == self._variableName:
+            return self._referenceTrie
+        if not name.startswith(self._variableName + "."):
+            return None
+        node = self._referenceTrie
+        for k in name[(len(self._variableName) + 1):].split("."):
+            node = node.getChild(k, create)
+            if node is None:
+                return None
+        return node
+
     def addReference(self, reference : ConfigurationVariableReference):
         self._references.append(reference)
+        node = self._getReferenceTrie(reference, True)
+        if node is None:
+            self._unmatchedReferences = self._unmatchedReferences + (reference,)
+        else:
+            node.addReference(reference)
     def removeReference(self, reference : ConfigurationVariableReference):
         self._references.remove(reference)
+        node = self._getReferenceTrie(reference)
+        if node is None:
+            self._unmatchedReferences = tuple([ref for ref in self._unmatchedReferences if ref is not reference])
+        else:
+            node.removeReference(reference)
+    def getReferences(self) -> List[ConfigurationVariableReference]:
+        return list(self._references)
 
     def reset(self):
         try:
@@ -59,150 +174,575 @@ class ConfigurationVariable:
         finally:
             self._isResetting = False
 
-    def setValue(self, value):
+    def convertValue(self, value):
+        """
+        Returns the value converted according to the type definition of the variable.
+        """
         try:
             if self._typeDef is None or self._typeDef == "none" or self._typeDef == "null":
-                self._value = value
+                return value
             elif self._typeDef == "str" or self._typeDef == "string":
-                self._value = str(value)
+                return str(value)
             elif self._typeDef == "list" or self._typeDef == "array":
-                self._value = str(value)
+                return str(value)
             elif self._typeDef == "dict" or self._typeDef == "dictionary" or self._typeDef == "object":
-                self._value = str(value)
+                return str(value)
             elif self._typeDef == "int" or self._typeDef == "integer":
-                self._value = str(value)
+                return str(value)
             elif self._typeDef == "float" or self._typeDef == "double":
-                self._value = str(value)
+                return str(value)
             elif self._typeDef == "bool" or self._typeDef == "boolean":
-                self._value = str(value)
+                return str(value)
             else:
                 habloLogger.warning("Invalid type definition '" + str(self._typeDef) + "' for variable: " + str(self._variableName) + ". The value will be set as is.")
-                self._value = value
+                return value
         except:
-            self._value = self._defaultValue
+            return self._defaultValue
+
+    def getReferenceValues(self, value, convertedValue, isResetting : bool = False) -> List[Tuple[ConfigurationVariableReference, object]]:
+        """
+        Returns the values that the references of this variable take for the given value.
+        """
+        values = []
+        for ref in self._referenceTrie.references:
+            values.append((ref, convertedValue))
+        self._referenceTrie.collectChildValues(value, values, isResetting)
+        for ref in self._unmatchedReferences:
+            habloLogger.warning("Found undefined variable reference: " + ref.getName())
+        return values
+
+    def setValue(self, value):
+        global _lastVariableChange
+        span = startSpan("config.propagate")
+        if span is not None:
+            span.setAttribute("variable", self._variableName)
+        self._value = self.convertValue(value)
+        self._rawValue = value
+        for ref, v in self.getReferenceValues(value, self._value, self._isResetting):
+            ref.setValue(v)
+        # bumped after propagating, so a concurrent dump never records the new version with old values
+        self._version += 1
+        _lastVariableChange = next(_variableChanges)
+        endSpan(span)
+
+    def updateReferences(self, references : set):
+        """
+        Sets the given references (a set of ids) to the current value of the variable, other references are not touched.
+        Like a reset it does not warn about references missing in the value.
+        """
+        for ref, v in self.getReferenceValues(self._rawValue, self._value, True):
+            if id(ref) in references:
+                ref.setValue(v)
+
+    def getVersion(self) -> int:
+        """
+        Returns a counter that changes whenever the value of the variable is set.
+        """
+        return self._version
+
+    def getDefaultValue(self):
+        return self._defaultValue
+
+    def getTypeDefinition(self):
+        return self._typeDef
+
+    def copy(self) -> "ConfigurationVariable":
+        """
+        Returns a copy of the variable, that shares the reference objects but not the reference index.
+        """
+        variable = ConfigurationVariable(self._variableName, self._defaultValue, self._typeDef)
+        variable._value = self._value
+        variable._rawValue = self._rawValue
         for ref in self._references:
-            if self._variableName == ref.getName():
-                ref.setValue(self._value)
-            elif ref.getName().startswith(self._variableName + "."):
-                try:
-                    v = value
-                    for k in ref.getName()[(len(self._variableName) + 1):].split("."):
-                        v = v[k]
-                    ref.setValue(v)
-                except:
-                    if not self._isResetting:
-                        habloLogger.warning("Failed to set variable reference: " + ref.getName())
-                    ref.setValue(None)
-            else:
-                habloLogger.warning("Found undefined variable reference: " + ref.getName())
+            variable.addReference(ref)
+        return variable
 
     def getName(self):
         return self._variableName
     def getValue(self):
         return self._value
 
+def _copyNativeData(configData, convertReference, getDump = None, setDump = None):
+    """
+    Copies configuration data into native python data types with an explicit stack, so deep configurations do not hit the recursion limit.
+    Variable references are replaced by convertReference(reference). getDump(container) can return an existing dump
+    to use instead of copying the container, setDump(container, native) is called for every copied container.
+    """
+    if isinstance(configData, ConfigurationVariableReference):
+        return convertReference(configData)
+    if not (isinstance(configData, dict) or isinstance(configData, list)):
+        return configData
+    if getDump is not None:
+        native = getDump(configData)
+        if native is not None:
+            return native
+    result = {} if isinstance(configData, dict) else []
+    if setDump is not None:
+        setDump(configData, result)
+    # the copies are created empty and filled when they are taken from the stack
+    stack = [(configData, result)]
+    while stack:
+        source, native = stack.pop()
+        isDict = isinstance(source, dict)
+        for k in (source if isDict else range(len(source))):
+            val = source[k]
+            if isinstance(val, ConfigurationVariableReference):
+                val = convertReference(val)
+            elif isinstance(val, dict) or isinstance(val, list):
+                dumped = None if getDump is None else getDump(val)
+                if dumped is None:
+                    dumped = {} if isinstance(val, dict) else []
+                    if setDump is not None:
+                        setDump(val, dumped)
+                    stack.append((val, dumped))
+                val = dumped
+            if isDict:
+                native[k] = val
+            else:
+                native.append(val)
+    return result
+
+def _dumpNativeData(configData, dumpDefinitions : bool = True):
+    """
+    Dumps configuration data in native python data types.
+    Variable references are dumped as their definition or as their value.
+    """
+    if dumpDefinitions:
+        return _copyNativeData(configData, lambda ref: '${' + str(ref.getName()) + '}')
+    return _copyNativeData(configData, lambda ref: ref.getValue())
+
+
+class ConfigurationDumpCache:
+    """
+    Memoizes the native dumps of the subtrees of a resolved configuration tree.
+    Definition dumps never change, value dumps of a subtree are invalidated when a variable referenced in it changes.
+    The returned dumps are shared and must not be modified.
+    """
+
+    def __init__(self, configData, variables : List[ConfigurationVariable]):
+        self._configData = configData
+        self._lock = threading.Lock()
+        self._containers = {}
+        self._parents = {}
+        self._referenceContainers = {}
+        self._variables = variables
+        self._variableVersions = {}
+        self._lastChange = _lastVariableChange
+        for variable in variables:
+            self._variableVersions[id(variable)] = variable.getVersion()
+        self._values = {}
+        self._subtreeReferences = {}
+        self._definitions = {}
+        self._index()
+
+    def _index(self):
+        stack = [(self._configData, None)]
+        while stack:
+            container, parentKey = stack.pop()
+            if not (isinstance(container, dict) or isinstance(container, list)):
+                continue
+            key = id(container)
+            if key in self._containers:
+                # shared subtree (e.g. a yaml alias), it has more than one parent
+                if parentKey is not None:
+                    self._parents[key].append(parentKey)
+                continue
+            self._containers[key] = container
+            self._parents[key] = [] if parentKey is None else [parentKey]
+            for val in (container.values() if isinstance(container, dict) else container):
+                if isinstance(val, ConfigurationVariableReference):
+                    self._referenceContainers.setdefault(val.getName(), []).append(key)
+                elif isinstance(val, dict) or isinstance(val, list):
+                    stack.append((val, key))
+
+    def getConfiguration(self):
+        return self._configData
+
+    def contains(self, configData) -> bool:
+        """
+        Returns True if the given data is a subtree of the indexed configuration tree.
+        """
+        return self._containers.get(id(configData)) is configData
+
+    def _refresh(self):
+        # read before the versions, a change during the scan is then seen by the next refresh
+        lastChange = _lastVariableChange
+        if lastChange == self._lastChange:
+            return
+        self._lastChange = lastChange
+        for variable in self._variables:
+            version = variable.getVersion()
+            if self._variableVersions[id(variable)] != version:
+                self._variableVersions[id(variable)] = version
+                for ref in variable.getReferences():
+                    self._invalidate(self._referenceContainers.get(ref.getName(), ()))
+
+    def _invalidate(self, containerKeys):
+        # a memoized subtree always has memoized children, so the walk stops at the first subtree that is not memoized
+        stack = list(containerKeys)
+        while stack:
+            key = stack.pop()
+            if self._values.pop(key, None) is not None:
+                stack.extend(self._parents[key])
+
+    def _getSubtreeReferences(self, configData) -> frozenset:
+        """
+        Returns the names of the references in a subtree, they are memoized for every container of the subtree.
+        """
+        key = id(configData)
+        if key in self._subtreeReferences:
+            return self._subtreeReferences[key]
+        # children are completed before their parents
+        stack = [(configData, False)]
+        while stack:
+            container, expanded = stack.pop()
+            if id(container) in self._subtreeReferences:
+                continue
+            values = container.values() if isinstance(container, dict) else container
+            if not expanded:
+                stack.append((container, True))
+                for val in values:
+                    if (isinstance(val, dict) or isinstance(val, list)) and id(val) not in self._subtreeReferences:
+                        stack.append((val, False))
+                continue
+            names = set()
+            for val in values:
+                if isinstance(val, ConfigurationVariableReference):
+                    names.add(val.getName())
+                elif isinstance(val, dict) or isinstance(val, list):
+                    names.update(self._subtreeReferences[id(val)])
+            self._subtreeReferences[id(container)] = frozenset(names)
+        return self._subtreeReferences[key]
+
+    def _isOverlaid(self, configData, overlaid) -> bool:
+        # overlaid may be changed by another thread, so only membership is tested
+        for name in self._getSubtreeReferences(configData):
+            if name in overlaid:
+                return True
+        return False
+
+    def _dump(self, configData, dumpDefinitions : bool):
+        memo = self._definitions if dumpDefinitions else self._values
+        def _getDump(container):
+            entry = memo.get(id(container))
+            if entry is not None and entry[0] is container:
+                return entry[1]
+            return None
+        def _setDump(container, native):
+            memo[id(container)] = (container, native)
+        if dumpDefinitions:
+            return _copyNativeData(configData, lambda ref: '${' + str(ref.getName()) + '}', _getDump, _setDump)
+        return _copyNativeData(configData, lambda ref: ref.getValue(), _getDump, _setDump)
+
+    def _dumpScoped(self, configData, overlaid, getReferenceValue):
+        # subtrees without overlaid references are taken from the shared value dumps
+        def _getDump(container):
+            if self._isOverlaid(container, overlaid):
+                return None
+            return self._dump(container, False)
+        return _copyNativeData(configData, getReferenceValue, _getDump)
+
+    def dump(self, configData, dumpDefinitions : bool = True):
+        """
+        Returns the memoized native dump of a subtree of the indexed configuration tree.
+        """
+        with self._lock:
+            if not dumpDefinitions:
+                self._refresh()
+            return self._dump(configData, dumpDefinitions)
+
+    def dumpScoped(self, configData, overlaid, getReferenceValue):
+        """
+        Returns the native dump of a subtree with the values of a variable scope.
+        Only the subtrees holding one of the overlaid references (a set or dict of reference names) are dumped again,
+        all other subtrees are taken from the shared memoized value dumps.
+        """
+        with self._lock:
+            self._refresh()
+            return self._dumpScoped(configData, overlaid, getReferenceValue)
+
+    def getStatistics(self) -> dict:
+        with self._lock:
+            return {
+                "containers": len(self._containers),
+                "definitions": len(self._definitions),
+                "values": len(self._values)
+            }
+
+
 class VariableResolver:
     _variableReferences = {}
     _definedVariables = {}
 
+    _dumpCache = None
+
     def __init__(self):
-        pass
+        self._variableReferences = {}
+        self._definedVariables = {}
+        self._collectedReferences = None
+        self._dumpCache = None
+        self._resolvedValues = {}
+
+    def __getstate__(self):
+        # the dump cache is keyed by object ids, it is rebuilt after unpickling
+        state = dict(self.__dict__)
+        state["_dumpCache"] = None
+        state["_resolvedValues"] = {}
+        return state
+
+    def getDumpCache(self, configData) -> ConfigurationDumpCache:
+        """
+        Returns the memoized dumps of the given resolved configuration tree.
+        """
+        cache = self._dumpCache
+        if cache is None or cache.getConfiguration() is not configData:
+            cache = ConfigurationDumpCache(configData, self.getVariables())
+            self._dumpCache = cache
+        return cache
 
     def _resolveParentVariable(self, variableName : str) -> Union[None, str]:
-        splitted = variableName.split(".")
-        while len(splitted) >= 2:
-            k = ".".join(splitted)
-            if k in self._definedVariables:
-                return self._definedVariables[k].getName()
-            splitted.pop()
+        # the longest prefix with at least two keys, that is a defined variable
+        end = variableName.rfind(".")
+        while end >= 0:
+            variable = self._definedVariables.get(variableName)
+            if variable is not None:
+                return variable.getName()
+            variableName = variableName[:end]
+            end = variableName.rfind(".")
         return None
 
-    def _resolveVariableFromValue(self, val : str, path : str = "") -> Union[None, ConfigurationVariableReference]:
-        if not isinstance(val, str):
-            return None
-        if val.startswith("${") and val.endswith("}"):
+    @staticmethod
+    def _formatPath(path : str, pathKeys : Union[list, None]) -> str:
+        """
+        Builds the path of a value for diagnostics from the keys of its containers.
+        """
+        if pathKeys is not None:
+            for key in pathKeys:
+                path = (path + "." + str(key)).lstrip(".")
+        return path
+
+    def _resolveVariableName(self, val : str) -> tuple:
+        """
+        Returns the variable reference name and its defined parent variable (or None) of a "${...}" value.
+        The result is cached per value, the same references usually occur many times.
+        """
+        resolved = self._resolvedValues.get(val)
+        if resolved is None:
             variableName = val[2:-1].strip()
             parentVariable = self._resolveParentVariable(variableName)
-            if parentVariable is None:
-                habloLogger.warning("Found undefined variable reference: " + variableName + " at " + path)
-            else:
+            if parentVariable is not None:
                 if not variableName.startswith(parentVariable):
                     if ("nodes." + variableName).startswith(parentVariable):
                         variableName = "nodes." + variableName
+            resolved = (variableName, parentVariable)
+            self._resolvedValues[val] = resolved
+        return resolved
+
+    def _resolveVariableFromValue(self, val : str, path : str = "", pathKeys : Union[list, None] = None) -> Union[None, ConfigurationVariableReference]:
+        """
+        Returns the reference object for a "${...}" value or None for other values.
+        The path of the value (path followed by pathKeys) is only built if a warning is logged.
+        """
+        if not isinstance(val, str):
+            return None
+        if val.startswith("${") and val.endswith("}"):
+            variableName, parentVariable = self._resolveVariableName(val)
+            if parentVariable is None:
+                habloLogger.warning("Found undefined variable reference: " + variableName + " at " + self._formatPath(path, pathKeys))
             if not (variableName in self._variableReferences):
                 self._variableReferences[variableName] = ConfigurationVariableReference(variableName)
                 if not (parentVariable is None):
                     self._definedVariables[parentVariable].addReference(self._variableReferences[variableName])
                 else:
                     self._variableReferences[variableName].setValue(val) # set the value to the reference
+            if self._collectedReferences is not None:
+                # the name of the reference object is interned, the sliced name is not kept
+                self._collectedReferences.add(self._variableReferences[variableName].getName())
             return self._variableReferences[variableName]
         return None
     def _resolveTreeVariables(self, config, path : str = ""):
-        # resolve go through the tree and resolve all variables
+        """
+        Replaces all "${...}" values in the tree by their reference objects, depth first and without recursion.
+        The keys of the containers being walked are kept on a stack, paths are only built for warnings.
+        """
         if isinstance(config, dict):
-            for key in config:
-                val = config[key]
-                if isinstance(val, str):
-                    cv = self._resolveVariableFromValue(val, (path + "." + str(key)).lstrip("."))
-                    if cv is not None:
-                        config[key] = cv
-                elif isinstance(val, dict) or isinstance(val, list):
-                    self._resolveTreeVariables(val, (path + "." + str(key)).lstrip("."))
+            iterators = [iter(config.items())]
         elif isinstance(config, list):
-            i = 0
-            for val in config:
+            iterators = [enumerate(config)]
+        else:
+            return
+        containers = [config]
+        pathKeys = []
+        while iterators:
+            container = containers[-1]
+            for key, val in iterators[-1]:
                 if isinstance(val, str):
-                    cv = self._resolveVariableFromValue(val, (path + "." + str(i)).lstrip("."))
-                    if cv is not None:
-                        config[i] = cv
-                elif isinstance(val, dict) or isinstance(val, list):
-                    self._resolveTreeVariables(val, (path + "." + str(i)).lstrip("."))
-                i = i + 1
+                    if val.startswith("${") and val.endswith("}"):
+                        pathKeys.append(key)
+                        container[key] = self._resolveVariableFromValue(val, path, pathKeys)
+                        pathKeys.pop()
+                elif isinstance(val, dict):
+                    iterators.append(iter(val.items()))
+                    containers.append(val)
+                    pathKeys.append(key)
+                    break
+                elif isinstance(val, list):
+                    iterators.append(enumerate(val))
+                    containers.append(val)
+                    pathKeys.append(key)
+                    break
+            else:
+                # the container is done, continue with its parent
+                iterators.pop()
+                containers.pop()
+                if pathKeys:
+                    pathKeys.pop()
     
-    def _resolveDefinedVariables(self, config):
+    @staticmethod
+    def _getDefinition(definition, key : str):
+        """
+        Returns a copy of definition[key] in native python data types, or None if the definition has no such key.
+        """
+        if not isinstance(definition, dict) or key not in definition:
+            return None
+        return _copyNativeData(definition[key], lambda ref: ref.getValue())
+
+    def _resolveDefinedVariables(self, configData):
+        """
+        Defines the variables of the inputs and node outputs, the raw data is read directly without creating views or dumps.
+        """
+        self._resolvedValues = {}
+        if not isinstance(configData, dict):
+            return
         # we are just intersted in setters (inputs)
-        if "inputs" in config:
-            for key in config["inputs"]:
-                nc = config["inputs"][key].getNativeConfiguration()
-                typeDef = None
+        inputs = configData.get("inputs")
+        if isinstance(inputs, dict):
+            for key in inputs:
                 varName = "inputs." + key
-                varDefault = None
-                if "type" in nc:
-                    typeDef = nc["type"]
-                if "default" in nc:
-                    varDefault = nc["default"]
-                self._definedVariables[varName] = ConfigurationVariable(varName, varDefault, typeDef)
+                self._definedVariables[varName] = ConfigurationVariable(varName, self._getDefinition(inputs[key], "default"), self._getDefinition(inputs[key], "type"))
         # we are just intersted in setters (node.outputs)
-        if "nodes" in config:
-            for key in config["nodes"]:
-                nc = config["nodes"][key].getNativeConfiguration()
-                typeDef = None
+        nodes = configData.get("nodes")
+        if isinstance(nodes, dict):
+            for key in nodes:
                 varName = "nodes." + key + ".output"
-                varDefault = None
-                if "outputs" in nc:
-                    typeDef = None
-                    if "type" in nc["outputs"]:
-                        typeDef = nc["outputs"]["type"]
-                    if "default" in nc["outputs"]:
-                        varDefault = nc["outputs"]["default"]
-                self._definedVariables[varName] = ConfigurationVariable(varName, varDefault, typeDef)
-                self._definedVariables[key + ".output"] = ConfigurationVariable(varName, varDefault, typeDef)
+                outputs = nodes[key].get("outputs") if isinstance(nodes[key], dict) else None
+                self._definedVariables[varName] = ConfigurationVariable(varName, self._getDefinition(outputs, "default"), self._getDefinition(outputs, "type"))
+                # the short form is an alias, so references registered on it are propagated as well
+                self._definedVariables[sys.intern(key + ".output")] = self._definedVariables[varName]
     
     def resolve(self, config):
         if not isinstance(config, RootConfiguration):
             raise ConfigurationValueError("The configuration object must be an instance of RootConfiguration.")
-        self._resolveDefinedVariables(config)
-        self._resolveTreeVariables(config.getConfiguration())
+        self._resolveDefinedVariables(config.getConfiguration())
+        try:
+            self._resolveTreeVariables(config.getConfiguration())
+        finally:
+            # the resolved names are only reused within one walk, they would keep every distinct value alive
+            self._resolvedValues = {}
+    def resolveDefinitions(self, configData):
+        """
+        Defines the variables (inputs and node outputs) of the given configuration data.
+        """
+        self._resolveDefinedVariables(configData)
+    def resolveSubtree(self, container, key, path : str = "") -> tuple:
+        """
+        Resolves the variable references of container[key] in place.
+        Returns the names of the references found in the subtree.
+        """
+        self._collectedReferences = set()
+        try:
+            val = container[key]
+            if isinstance(val, str):
+                cv = self._resolveVariableFromValue(val, path)
+                if cv is not None:
+                    container[key] = cv
+            elif isinstance(val, dict) or isinstance(val, list):
+                self._resolveTreeVariables(val, path)
+            return tuple(self._collectedReferences)
+        finally:
+            self._collectedReferences = None
+            self._resolvedValues = {}
+    def getVariableDefinitions(self) -> list:
+        """
+        Returns the name, type definition and default value of all defined variables.
+        """
+        definitions = []
+        for key in self._definedVariables:
+            variable = self._definedVariables[key]
+            definitions.append((key, variable.getName(), variable.getTypeDefinition(), variable.getDefaultValue()))
+        return definitions
+    def fork(self) -> "VariableResolver":
+        """
+        Returns a resolver with copies of the variables of this resolver, that shares the reference objects.
+        It is used to resolve changed subtrees of a reloaded configuration without touching this resolver,
+        the shared references must not be reset, because the current configuration tree still holds them.
+        """
+        resolver = VariableResolver()
+        copies = {}
+        for key in self._definedVariables:
+            variable = self._definedVariables[key]
+            if id(variable) not in copies:
+                copies[id(variable)] = variable.copy()
+            resolver._definedVariables[key] = copies[id(variable)]
+        resolver._variableReferences = dict(self._variableReferences)
+        return resolver
+    def pruneReferences(self, usedReferences : set):
+        """
+        Removes all references that are not in the given set of reference names.
+        """
+        for variableName in list(self._variableReferences):
+            if variableName in usedReferences:
+                continue
+            ref = self._variableReferences.pop(variableName)
+            parentVariable = self._resolveParentVariable(variableName)
+            if parentVariable is not None:
+                self._definedVariables[parentVariable].removeReference(ref)
     def hasVariable(self, variableName : str) -> bool:
         return variableName in self._definedVariables
+    def getVariables(self) -> List[ConfigurationVariable]:
+        """
+        Returns all defined variables, aliases are only returned once.
+        """
+        variables = {}
+        for variable in self._definedVariables.values():
+            variables[id(variable)] = variable
+        return list(variables.values())
     def resetVariables(self):
-        for key in self._definedVariables:
-            self._definedVariables[key].reset()
+        for variable in self.getVariables():
+            variable.reset()
+    def updateReferences(self, references : set):
+        """
+        Sets the given references (a set of ids) to the current values of their variables.
+        """
+        for variable in self.getVariables():
+            variable.updateReferences(references)
     def setVariable(self, variableName : str, value):
         if variableName in self._definedVariables:
             self._definedVariables[variableName].setValue(value)
             return True
         return False
+    def _groupVariableValues(self, values : dict) -> Tuple[list, bool]:
+        """
+        Maps the given variable names to their variables, the last value set for an alias wins.
+        """
+        grouped = {}
+        allDefined = True
+        for variableName in values:
+            variable = self._definedVariables.get(variableName)
+            if variable is None:
+                allDefined = False
+                continue
+            grouped[id(variable)] = (variable, values[variableName])
+        return list(grouped.values()), allDefined
+    def setVariables(self, values : dict) -> bool:
+        """
+        Sets several variables at once, each variable propagates to its references only once.
+        Returns False if any of the variables is not defined, the defined ones are set anyway.
+        """
+        grouped, allDefined = self._groupVariableValues(values)
+        for variable, value in grouped:
+            variable.setValue(value)
+        return allDefined
     def getVariable(self, variableName : str) -> Union[ConfigurationVariable, None]:
         if variableName in self._definedVariables:
             return self._definedVariables[variableName]
@@ -215,49 +755,194 @@ class VariableResolver:
         return list(self._variableReferences.values())
 
 
+class ConfigurationPath:
+    """
+    Represents a pre-split dotted path, that can be reused to access configuration data.
+    """
+    _path : str = ""
+    _keys : Tuple[str, ...] = ()
+
+    def __init__(self, path : str):
+        self._path = path
+        self._keys = tuple(path.split("."))
+
+    def getPath(self) -> str:
+        return self._path
+
+    def getKeys(self) -> Tuple[str, ...]:
+        return self._keys
+
+    def lookup(self, configData):
+        """
+        Returns the value at this path within the given configuration data.
+        """
+        _cfg = configData
+        try:
+            for currentKey in self._keys:
+                _cfg = _cfg[currentKey]
+            return _cfg
+        except:
+            # the missing key is searched again, so successful lookups do not count the keys
+            i = 0
+            _cfg = configData
+            try:
+                for currentKey in self._keys:
+                    i = i + 1
+                    _cfg = _cfg[currentKey]
+            except:
+                pass
+            fullCurrentKey = ".".join(self._keys[:i])
+            if fullCurrentKey == self._path:
+                raise ConfigurationKeyError("The key \"" + fullCurrentKey + "\" does not exist exist.")
+            else:
+                raise ConfigurationKeyError("The key \"" + fullCurrentKey + "\" does not exist and hence the key \"" + self._path + "\" does not exist.")
+
+    def __str__(self):
+        return self._path
+
+
+class ConfigurationAccessCache:
+    """
+    Bounded caches for compiled paths and configuration views of a configuration tree.
+    Lookups read plain dicts without taking the lock, only insertions are locked.
+    When a cache is full the oldest entry is evicted, the hit counters are approximate under concurrent access.
+    """
+    _maxPaths : int = 1024
+    _maxViews : int = 1024
+
+    def __init__(self, maxPaths : int = 1024, maxViews : int = 1024):
+        self._maxPaths = maxPaths
+        self._maxViews = maxViews
+        self._lock = threading.Lock()
+        self._paths = {}
+        self._views = {}
+        self._pathHits = 0
+        self._pathMisses = 0
+        self._viewHits = 0
+        self._viewMisses = 0
+
+    def compilePath(self, path : Union[str, ConfigurationPath]) -> ConfigurationPath:
+        """
+        Returns the compiled path for the given dotted path.
+        """
+        compiled = self._paths.get(path)
+        if compiled is not None:
+            self._pathHits += 1
+            return compiled
+        if isinstance(path, ConfigurationPath):
+            return path
+        compiled = ConfigurationPath(path)
+        with self._lock:
+            self._pathMisses += 1
+            if path not in self._paths:
+                if len(self._paths) >= self._maxPaths:
+                    del self._paths[next(iter(self._paths))]
+                self._paths[path] = compiled
+        return compiled
+
+    def getView(self, configData, parent : "BaseConfiguration") -> "Configuration":
+        """
+        Returns a reusable configuration view for the given subtree.
+        """
+        key = (id(parent), id(configData))
+        view = self._views.get(key)
+        # the view keeps both objects alive, so the ids cannot be reused while it is cached
+        if view is not None and view._configuration is configData and view._parent is parent:
+            self._viewHits += 1
+            return view
+        view = Configuration(configData = configData, parent = parent)
+        with self._lock:
+            self._viewMisses += 1
+            if key not in self._views and len(self._views) >= self._maxViews:
+                del self._views[next(iter(self._views))]
+            self._views[key] = view
+        return view
+
+    def clear(self):
+        """
+        Invalidates all cached paths and views.
+        """
+        with self._lock:
+            self._paths.clear()
+            self._views.clear()
+
+    def getStatistics(self) -> dict:
+        """
+        Returns the hit and miss counters of the caches.
+        """
+        with self._lock:
+            return {
+                "pathHits": self._pathHits,
+                "pathMisses": self._pathMisses,
+                "paths": len(self._paths),
+                "viewHits": self._viewHits,
+                "viewMisses": self._viewMisses,
+                "views": len(self._views)
+            }
+
+
 class BaseConfiguration(ABC):
     """
     Base class for all configuration classes that can be used to access configuration data.
     """
-    _configuration = {}
+    # the tree views (Configuration) are slotted, root configurations keep a __dict__
+    __slots__ = ()
+    _accessCache = None
     
     def getConfiguration(self):
         return self._configuration
+
+    def _getRoot(self) -> Union["RootConfiguration", None]:
+        return None
+
+    def _getAccessCache(self) -> ConfigurationAccessCache:
+        cache = self._accessCache
+        if cache is None:
+            # views keep the cache of their root, the root clears it in place and never replaces it
+            root = self._getRoot()
+            if root is not None and root is not self:
+                cache = root._getAccessCache()
+            else:
+                cache = ConfigurationAccessCache()
+            self._accessCache = cache
+        return cache
+
+    def getAccessStatistics(self) -> dict:
+        """
+        Returns the hit and miss counters of the compiled path and view caches.
+        """
+        return self._getAccessCache().getStatistics()
+
+    def compilePath(self, path : Union[str, ConfigurationPath]) -> ConfigurationPath:
+        """
+        Compiles a dotted path, that can be passed to get, getValue and pathExists.
+        """
+        return self._getAccessCache().compilePath(path)
        
-    def get(self, path):
+    def get(self, path : Union[str, ConfigurationPath]):
         val = self.getValue(path) 
         if isinstance(val, dict) or isinstance(val, list):
-            return Configuration(configData = val, parent = self)
+            return self._getAccessCache().getView(val, self)
         else:
             return val
-    def pathExists(self, path):
+    def pathExists(self, path : Union[str, ConfigurationPath]):
         _cfg = self._configuration
         try:
-            for currentKey in path.split("."):
+            # plain paths are split directly, existence checks do not fill the path cache
+            for currentKey in (path.getKeys() if isinstance(path, ConfigurationPath) else path.split(".")):
                 _cfg = _cfg[currentKey]
             return True
         except:
             return False
 
-    def getValue(self, path):
-        _cfg = self._configuration
-        fullCurrentKey = []
-        try:
-            for currentKey in path.split("."):
-                fullCurrentKey.append(currentKey)
-                _cfg = _cfg[currentKey]
-            return _cfg
-        except:
-            fullCurrentKey = ".".join(fullCurrentKey)
-            if fullCurrentKey == path:
-                raise ConfigurationKeyError("The key \"" + fullCurrentKey + "\" does not exist exist.")
-            else:
-                raise ConfigurationKeyError("The key \"" + fullCurrentKey + "\" does not exist and hence the key \"" + path + "\" does not exist.")
+    def getValue(self, path : Union[str, ConfigurationPath]):
+        return self._getAccessCache().compilePath(path).lookup(self._configuration)
 
     def getNativeConfiguration(self):
         """
         Returns the configuration data in native python data types.
         It also resolves all variable references.
+        The result is memoized per subtree and shared, so it must not be modified.
         """
         return self._dumpNative(False)
     
@@ -265,50 +950,32 @@ class BaseConfiguration(ABC):
         """
         Dumps the configuration data in native python data types, that can be exported to json or yaml.
         """
-        if isinstance(self._configuration, dict):
-            d = {}
-            for k in self._configuration:
-                if isinstance(self._configuration[k], ConfigurationVariableReference):
-                    if dumpDefinitions:
-                        d[k] = '${' + str(self._configuration[k].getName()) + '}'
-                    else:
-                        d[k] = self._configuration[k].getValue()
-                elif isinstance(self._configuration[k], dict) or isinstance(self._configuration[k], list):
-                    d[k] = Configuration(configData = self._configuration[k])._dumpNative()
-                else:
-                    d[k] = self._configuration[k]
-            return d
-        elif isinstance(self._configuration, list):
-            l = []
-            for x in self._configuration:
-                if isinstance(x, ConfigurationVariableReference):
-                    l.append('${' + str(x.getName()) + '}')
-                elif isinstance(x, dict) or isinstance(x, list):
-                    l.append(Configuration(configData = x)._dumpNative())
-                else:
-                    l.append(x)
-            return l
-        elif isinstance(self._configuration, ConfigurationVariableReference):
+        if isinstance(self._configuration, ConfigurationVariableReference):
             return '${' + str(self._configuration.getName()) + "}"
-        else:
-            return self._configuration
+        root = self._getRoot()
+        if root is not None:
+            cache = root._getDumpCache()
+            if cache is not None and cache.contains(self._configuration):
+                return cache.dump(self._configuration, dumpDefinitions)
+        return _dumpNativeData(self._configuration, dumpDefinitions)
     
     def dump(self, format : str ="yaml", raw : bool = False) -> str:
         if format == "json":
             return str(json.dumps(self._dumpNative())).rstrip()
         elif format == "yaml":
             if raw:
-                return str(yaml.dump(self._configuration)).rstrip()
+                return str(_dumpYaml(self._configuration)).rstrip()
             else:
-                return str(yaml.dump(self._dumpNative())).rstrip()
+                return str(_dumpYaml(self._dumpNative())).rstrip()
         else:
             raise ConfigurationValueError("Invalid format specified. Please use either json or yaml.")
 
     def __getitem__(self, key):
-        if isinstance(self._configuration[key], dict) or isinstance(self._configuration[key], list):
-            return Configuration(configData = self._configuration[key])
+        val = self._configuration[key]
+        if isinstance(val, dict) or isinstance(val, list):
+            return self._getAccessCache().getView(val, self)
         else:
-            return self._configuration[key] 
+            return val
 
     def __iter__(self):
         if isinstance(self._configuration, dict):
@@ -329,27 +996,178 @@ class Configuration(BaseConfiguration):
     Represents a configuration object that can be used to access configuration data.
     This is the base class for all nodes within the configuration tree.
     """
-    _parent = None
+    __slots__ = ("_configuration", "_accessCache", "_parent", "_root")
 
     def __init__(self, configData = None, parent : Union[BaseConfiguration, None] = None):
         if configData is not None:
             self._configuration = configData
         else:
             self._configuration = {}
+        self._accessCache = None
         self._parent = parent
+        self._root = None if parent is None else parent._getRoot()
 
     def getParent(self) -> Union[BaseConfiguration, None]:
         return self._parent
 
+    def _getRoot(self) -> Union["RootConfiguration", None]:
+        return self._root
 
 
 
+
+def _getConfigurationUnits(configData) -> Union[None, list]:
+    """
+    Splits the configuration data into the subtrees that are compared and resolved independently on reload.
+    Every input and every node is its own unit, all other top level entries are a unit each.
+    """
+    if not isinstance(configData, dict):
+        return None
+    units = []
+    for key in configData:
+        val = configData[key]
+        if (key == "inputs" or key == "nodes") and isinstance(val, dict):
+            for subKey in val:
+                units.append(((key, subKey), val, subKey))
+        else:
+            units.append(((key,), configData, key))
+    return units
+
+def _getConfigurationUnit(configData, unitKey : tuple):
+    for key in unitKey:
+        configData = configData[key]
+    return configData
+
+# longer strings are rarely repeated, interning them would only cost time
+_INTERN_MAX_LENGTH = 64
+
+def _getScalarKey(val):
+    """
+    Returns a key, that only matches scalars with the same type and representation.
+    The type is part of the key, because 1, 1.0 and True are equal, floats are keyed by repr, because 0.0 and -0.0 are equal.
+    """
+    if isinstance(val, str):
+        return val
+    if isinstance(val, float):
+        return (float, repr(val))
+    return (type(val), val)
+
+def _shareConfigurationData(container, sharedSubtrees : dict):
+    """
+    Interns the keys and short strings of resolved configuration data in place and replaces
+    equal subtrees without variable references by a single shared object. Subtrees are only equal,
+    if their keys and scalars have the same types and representations (see _getScalarKey).
+    Configuration data is read-only once it is loaded, so the sharing cannot be observed.
+    Returns the structural key of the container, or None if it contains variable references.
+    """
+    # the containers are compacted children first with an explicit stack, so deep configurations do not hit the recursion limit
+    containerKeys = {}
+    stack = [(container, False)]
+    while stack:
+        current, expanded = stack.pop()
+        if id(current) in containerKeys:
+            continue
+        isDict = isinstance(current, dict)
+        if not expanded:
+            stack.append((current, True))
+            for val in (current.values() if isDict else current):
+                if (isinstance(val, dict) or isinstance(val, list)) and id(val) not in containerKeys:
+                    stack.append((val, False))
+            continue
+        items = list(current.items()) if isDict else list(enumerate(current))
+        if isDict:
+            current.clear()
+        shareable = True
+        childKeys = []
+        for key, val in items:
+            if isinstance(val, str):
+                if len(val) <= _INTERN_MAX_LENGTH:
+                    val = sys.intern(val)
+                childKey = val
+            elif isinstance(val, dict) or isinstance(val, list):
+                childKey = containerKeys[id(val)]
+                if childKey is not None:
+                    val = sharedSubtrees.setdefault(childKey, val)
+                    # equal subtrees are the same object now, so the key stays flat however deep the data is
+                    childKey = (None, id(val))
+            elif isinstance(val, ConfigurationVariableReference):
+                childKey = None
+            else:
+                childKey = _getScalarKey(val)
+            if isDict:
+                if isinstance(key, str):
+                    key = sys.intern(key)
+                current[key] = val
+                childKeys.append((_getScalarKey(key), childKey))
+            else:
+                current[key] = val
+                childKeys.append(childKey)
+            if childKey is None:
+                shareable = False
+        containerKey = None
+        if shareable:
+            containerKey = (dict if isDict else list, tuple(childKeys))
+            try:
+                hash(containerKey)
+            except TypeError:
+                containerKey = None
+        containerKeys[id(current)] = containerKey
+    return containerKeys[id(container)]
+
+def _reprConfigurationData(configData) -> str:
+    """
+    Returns the same text as repr() for nested dicts, lists and tuples, but uses an explicit stack instead of recursion.
+    """
+    parts = []
+    # the stack holds text to emit as is (True) and values to render (False)
+    stack = [(False, configData)]
+    while stack:
+        isText, val = stack.pop()
+        if isText:
+            parts.append(val)
+            continue
+        valType = type(val)
+        if valType is dict:
+            items = [(True, "{")]
+            for k in val:
+                if len(items) > 1:
+                    items.append((True, ", "))
+                items.append((True, repr(k) + ": "))
+                items.append((False, val[k]))
+            items.append((True, "}"))
+        elif valType is list or valType is tuple:
+            items = [(True, "[" if valType is list else "(")]
+            for x in val:
+                if len(items) > 1:
+                    items.append((True, ", "))
+                items.append((False, x))
+            items.append((True, "]" if valType is list else (",)" if len(val) == 1 else ")")))
+        else:
+            parts.append(repr(val))
+            continue
+        items.reverse()
+        stack.extend(items)
+    return "".join(parts)
+
+def _digestConfigurationData(configData) -> bytes:
+    try:
+        text = repr(configData)
+    except RecursionError:
+        # the builtin repr is much faster, the same text is built without recursion only for deep configurations
+        text = _reprConfigurationData(configData)
+    return hashlib.blake2b(text.encode("utf-8"), digest_size = 16).digest()
+
+
 class RootConfiguration(BaseConfiguration):
     """
     Base class for all configuration classes that configuration can be reloaded from.
     It represents the root of the configuration tree.
     """
+    _configuration = {}
     _variableResolver = None
+    _state = None
+    _loadState = None
+    _loadTimings = {}
 
     def getVariableResolver(self) -> Union[None, VariableResolver]:
         """
@@ -358,6 +1176,39 @@ class RootConfiguration(BaseConfiguration):
         """
         return self._variableResolver
 
+    def _getRoot(self) -> "RootConfiguration":
+        return self
+
+    def _getState(self) -> tuple:
+        """
+        Returns the configuration data together with its variable resolver.
+        Both are swapped together on reload, so the returned pair is always consistent.
+        """
+        state = self._state
+        if state is None:
+            return (self._configuration, self._variableResolver)
+        return state
+
+    def _getDumpCache(self) -> Union[ConfigurationDumpCache, None]:
+        configData, resolver = self._getState()
+        if resolver is None:
+            return None
+        return resolver.getDumpCache(configData)
+
+    def getLoadTimings(self) -> dict:
+        """
+        Returns how long each phase of the last load took in seconds (read, cacheLoad, parse, resolve, reset, cacheStore).
+        """
+        return dict(self._loadTimings)
+
+    def createScope(self) -> "VariableScope":
+        """
+        Creates a lightweight variable scope for a single request.
+        Variables set in the scope overlay the shared configuration without modifying it,
+        so scopes can be used concurrently from threads and asyncio tasks.
+        """
+        return VariableScope(self)
+
     @abstractmethod
     def reload(self):
         raise NotImplementedError("Subclasses must implement this method")
@@ -366,9 +1217,254 @@ class RootConfiguration(BaseConfiguration):
         """
         This method is called after the configuration data is reloaded.
         """
-        self._variableResolver = VariableResolver()
-        self._variableResolver.resolve(self)
-        self._variableResolver.resetVariables()
+        timings = {}
+        configData = self._configuration
+        if self._state is not None:
+            # readers keep the published tree, _configuration is only replaced by _swapConfiguration
+            self._configuration = self._state[0]
+        self._loadConfigurationData(configData, timings)
+        self._loadTimings = timings
+
+    def _swapConfiguration(self, configData, resolver : VariableResolver):
+        """
+        Publishes a fully resolved configuration, readers see either the old or the new configuration.
+        """
+        self._state = (configData, resolver)
+        self._configuration = configData
+        self._variableResolver = resolver
+        self._getAccessCache().clear()
+
+    def _loadSource(self, content : Union[str, bytes], sourceFormat : str, parse, cache = None, timings : Union[dict, None] = None) -> bool:
+        """
+        Loads the configuration from its source content, using the compiled configuration cache if one is given.
+        Returns False if the configuration did not change.
+        """
+        if timings is None:
+            timings = {}
+        digest = hashlib.sha256(sourceFormat.encode("utf-8") + b"\0" + (content.encode("utf-8") if isinstance(content, str) else content)).digest()
+        if cache is not None:
+            t = time.perf_counter()
+            span = startSpan("config.cacheLoad")
+            state = cache.load(digest)
+            if span is not None:
+                span.setAttribute("hit", state is not None)
+            endSpan(span)
+            timings["cacheLoad"] = time.perf_counter() - t
+            if state is not None:
+                configData, resolver, self._loadState = state
+                self._swapConfiguration(configData, resolver)
+                self._loadTimings = timings
+                return True
+        t = time.perf_counter()
+        span = startSpan("config.parse", {"format": sourceFormat})
+        configData = parse(content)
+        endSpan(span)
+        timings["parse"] = time.perf_counter() - t
+        changed = self._loadConfigurationData(configData, timings)
+        if cache is not None:
+            t = time.perf_counter()
+            span = startSpan("config.cacheStore")
+            configData, resolver = self._getState()
+            cache.store(digest, (configData, resolver, self._loadState))
+            endSpan(span)
+            timings["cacheStore"] = time.perf_counter() - t
+        self._loadTimings = timings
+        return changed
+
+    def _loadConfigurationData(self, configData, timings : Union[dict, None] = None) -> bool:
+        """
+        Resolves freshly parsed configuration data and swaps it in atomically.
+        If the variable definitions did not change, unchanged subtrees of the current configuration
+        are reused and only the changed subtrees are resolved.
+        Returns False if the configuration did not change at all.
+        """
+        if timings is None:
+            timings = {}
+        t = time.perf_counter()
+        span = startSpan("config.resolve")
+        units = _getConfigurationUnits(configData)
+        resolver = VariableResolver()
+        resolver.resolveDefinitions(configData)
+        if units is None:
+            resolver._resolveTreeVariables(configData)
+            if isinstance(configData, dict) or isinstance(configData, list):
+                _shareConfigurationData(configData, {})
+            timings["resolve"] = time.perf_counter() - t
+            endSpan(span)
+            t = time.perf_counter()
+            span = startSpan("config.reset")
+            resolver.resetVariables()
+            endSpan(span)
+            timings["reset"] = time.perf_counter() - t
+            self._loadState = None
+            self._swapConfiguration(configData, resolver)
+            return True
+
+        digests = {}
+        for unitKey, container, key in units:
+            digests[unitKey] = _digestConfigurationData(container[key])
+        # only a digest of the definitions is kept, they are compared on the next reload
+        definitions = _digestConfigurationData(resolver.getVariableDefinitions())
+
+        previous = self._loadState
+        oldData, oldResolver = self._getState()
+        if previous is not None and oldResolver is not None and previous[1] == definitions:
+            if previous[0] == digests:
+                timings["resolve"] = time.perf_counter() - t
+                endSpan(span)
+                return False
+            resolver = oldResolver.fork()
+            oldReferences = set([id(ref) for ref in resolver.getReferencedVariables()])
+        else:
+            previous = None
+
+        unitReferences = {}
+        sharedSubtrees = {}
+        for unitKey, container, key in units:
+            if previous is not None and previous[0].get(unitKey) == digests[unitKey]:
+                container[key] = _getConfigurationUnit(oldData, unitKey)
+                unitReferences[unitKey] = previous[2][unitKey]
+            else:
+                unitReferences[unitKey] = resolver.resolveSubtree(container, key, ".".join([str(k) for k in unitKey]).lstrip("."))
+                # reused units may be read concurrently, only the freshly parsed ones are compacted
+                if isinstance(container[key], dict) or isinstance(container[key], list):
+                    _shareConfigurationData(container[key], sharedSubtrees)
+        if previous is not None:
+            usedReferences = set()
+            for references in unitReferences.values():
+                usedReferences.update(references)
+            resolver.pruneReferences(usedReferences)
+        timings["resolve"] = time.perf_counter() - t
+        endSpan(span)
+        t = time.perf_counter()
+        span = startSpan("config.reset")
+        if previous is None:
+            resolver.resetVariables()
+        else:
+            # the reused subtrees are shared with the current tree, so only the new references get the current values
+            newReferences = set([id(ref) for ref in resolver.getReferencedVariables()]) - oldReferences
+            resolver.updateReferences(newReferences)
+        endSpan(span)
+        timings["reset"] = time.perf_counter() - t
+        self._loadState = (digests, definitions, unitReferences)
+        self._swapConfiguration(configData, resolver)
+        return True
+
+
+class VariableScope:
+    """
+    Represents a per-request copy-on-write overlay over the variables of a resolved configuration.
+    Setting a variable only records the new values in the scope, the shared configuration tree and
+    its variable resolver are never modified. Create one scope per request with RootConfiguration.createScope().
+    """
+
+    def __init__(self, configuration : "RootConfiguration"):
+        self._root = configuration
+        self._data, self._resolver = configuration._getState()
+        self._lock = threading.Lock()
+        self._variableValues = {}
+        self._referenceValues = {}
+
+    def getConfiguration(self):
+        """
+        Returns the shared configuration data this scope overlays.
+        """
+        return self._data
+
+    def getVariableResolver(self) -> Union[None, VariableResolver]:
+        return self._resolver
+
+    def hasVariable(self, variableName : str) -> bool:
+        return self._resolver is not None and self._resolver.hasVariable(variableName)
+
+    def setVariable(self, variableName : str, value) -> bool:
+        variable = None if self._resolver is None else self._resolver.getVariable(variableName)
+        if variable is None:
+            return False
+        span = startSpan("config.propagate")
+        if span is not None:
+            span.setAttribute("variable", variable.getName())
+        convertedValue = variable.convertValue(value)
+        referenceValues = variable.getReferenceValues(value, convertedValue)
+        with self._lock:
+            self._variableValues[variable.getName()] = convertedValue
+            for ref, v in referenceValues:
+                self._referenceValues[ref.getName()] = v
+        endSpan(span)
+        return True
+
+    def setVariables(self, values : dict) -> bool:
+        """
+        Sets several variables at once, the new values become visible to readers of the scope together.
+        Returns False if any of the variables is not defined, the defined ones are set anyway.
+        """
+        if self._resolver is None:
+            return len(values) == 0
+        grouped, allDefined = self._resolver._groupVariableValues(values)
+        variableValues = []
+        referenceValues = []
+        for variable, value in grouped:
+            span = startSpan("config.propagate")
+            if span is not None:
+                span.setAttribute("variable", variable.getName())
+            convertedValue = variable.convertValue(value)
+            variableValues.append((variable.getName(), convertedValue))
+            referenceValues.extend(variable.getReferenceValues(value, convertedValue))
+            endSpan(span)
+        with self._lock:
+            for variableName, v in variableValues:
+                self._variableValues[variableName] = v
+            for ref, v in referenceValues:
+                self._referenceValues[ref.getName()] = v
+        return allDefined
+
+    def resetVariables(self):
+        """
+        Drops all values set in this scope, so the shared values become visible again.
+        """
+        with self._lock:
+            self._variableValues = {}
+            self._referenceValues = {}
+
+    def getVariableValue(self, variableName : str):
+        variable = None if self._resolver is None else self._resolver.getVariable(variableName)
+        if variable is None:
+            return None
+        return self._variableValues.get(variable.getName(), variable.getValue())
+
+    def getReferenceValue(self, reference : Union[str, ConfigurationVariableReference]):
+        if not isinstance(reference, ConfigurationVariableReference):
+            reference = None if self._resolver is None else self._resolver.getVariableReference(reference)
+            if reference is None:
+                return None
+        return self._referenceValues.get(reference.getName(), reference.getValue())
+
+    def getValue(self, path : Union[str, ConfigurationPath]):
+        """
+        Returns the value at the given path, variable references are replaced by their value in this scope.
+        """
+        val = self._root.compilePath(path).lookup(self._data)
+        if isinstance(val, ConfigurationVariableReference):
+            return self.getReferenceValue(val)
+        return val
+
+    def getNativeConfiguration(self, path : Union[str, ConfigurationPath, None] = None):
+        """
+        Returns the configuration data (or the subtree at the given path) in native python data types.
+        Variable references are replaced by their value in this scope.
+        """
+        if path is None:
+            data = self._data
+        else:
+            data = self.getValue(path)
+        if self._resolver is not None:
+            cache = self._resolver.getDumpCache(self._data)
+            if cache.contains(data):
+                return cache.dumpScoped(data, self._referenceValues, self.getReferenceValue)
+        return self._dumpValues(data)
+
+    def _dumpValues(self, data):
+        return _copyNativeData(data, self.getReferenceValue)
 
 
 class FileConfiguration(RootConfiguration):
@@ -377,52 +1473,141 @@ class FileConfiguration(RootConfiguration):
     It supports both json and yaml file formats.
     """
     configpath : str = ""
+    _fileSignature = None
+    _fileDigest = None
+    _watcher = None
+    _cache = None
 
-    def __init__(self, configpath: str):
+    def __init__(self, configpath: str, cache = None):
+        """
+        Loads the configuration file, cache can be a CompiledConfigurationCache to skip parsing and resolving.
+        """
         self.configpath = configpath
+        self._cache = cache
         self.reload()
 
+    def _getSourceFormat(self) -> str:
+        return self.configpath.split(".")[-1].lower()
+
+    def _parse(self, content : bytes):
+        suffix = self._getSourceFormat()
+        # if configpath ends with .json
+        if suffix == "json":
+            return json.loads(content)
+        elif suffix in ["yaml", "yml"]:
+            return _loadYaml(content)
+        raise ConfigurationValueError("Unsupported configuration file format: " + self.configpath)
+
+    def _getFileSignature(self) -> tuple:
+        st = os.stat(self.configpath)
+        return (st.st_mtime_ns, st.st_size)
+
+    def _readFile(self, timings : dict) -> Tuple[tuple, bytes]:
+        t = time.perf_counter()
+        span = startSpan("config.read", {"path": self.configpath})
+        signature = self._getFileSignature()
+        with open(self.configpath, "rb") as f:
+            content = f.read()
+        endSpan(span)
+        timings["read"] = time.perf_counter() - t
+        return signature, content
+
     def reload(self):
-        suffix = self.configpath.split(".")[-1].lower()
-        with open(self.configpath, "r") as f:
-            # if configpath ends with .json
-            if suffix == "json":
-                self._configuration = json.load(f)
-            elif suffix in ["yaml", "yml"]:
-                self._configuration = yaml.safe_load(f)
-        self._dataReloaded()
+        timings = {}
+        signature, content = self._readFile(timings)
+        self._loadSource(content, self._getSourceFormat(), self._parse, self._cache, timings)
+        self._fileSignature = signature
+        self._fileDigest = hashlib.sha256(content).digest()
+
+    def checkForChanges(self) -> bool:
+        """
+        Reloads the configuration if the file changed since it was loaded.
+        The file is only read if its modification time or size changed, and only parsed if its content changed.
+        Returns True if a changed configuration was swapped in.
+        """
+        if self._getFileSignature() == self._fileSignature:
+            return False
+        timings = {}
+        signature, content = self._readFile(timings)
+        digest = hashlib.sha256(content).digest()
+        if digest == self._fileDigest:
+            self._fileSignature = signature
+            return False
+        changed = self._loadSource(content, self._getSourceFormat(), self._parse, self._cache, timings)
+        self._fileSignature = signature
+        self._fileDigest = digest
+        return changed
+
+    def watch(self, interval : float = 1.0):
+        """
+        Starts a background thread, that polls the file and hot reloads the configuration when it changes.
+        """
+        if self._watcher is not None:
+            return
+        stopEvent = threading.Event()
+        def _watch():
+            while not stopEvent.wait(interval):
+                try:
+                    if self.checkForChanges():
+                        habloLogger.info("Reloaded changed configuration file: " + self.configpath)
+                except Exception:
+                    habloLogger.exception("Failed to reload configuration file: " + self.configpath)
+        thread = threading.Thread(target = _watch, name = "hablo-config-watch", daemon = True)
+        self._watcher = (thread, stopEvent)
+        thread.start()
+
+    def stopWatching(self):
+        """
+        Stops the background thread started by watch().
+        """
+        if self._watcher is None:
+            return
+        thread, stopEvent = self._watcher
+        self._watcher = None
+        stopEvent.set()
+        if thread is not threading.current_thread():
+            thread.join()
 
 class JsonStreamConfiguration(RootConfiguration):
     """
     Represents a configuration object that can be used to access configuration json data from a stream.
     """
     _stream = None
+    _cache = None
 
-    def __init__(self, stream : io.TextIOBase):
+    def __init__(self, stream : io.TextIOBase, cache = None):
         self._stream = stream
+        self._cache = cache
         self.reload()
 
     def reload(self):
+        timings = {}
+        t = time.perf_counter()
         self._stream.seek(0)
-        self._configuration = json.load(self._stream)
-        self._dataReloaded()
+        content = self._stream.read()
+        timings["read"] = time.perf_counter() - t
+        self._loadSource(content, "json", json.loads, self._cache, timings)
 
 class YamlStreamConfiguration(RootConfiguration):
     """
     Represents a configuration object that can be used to access configuration yaml data from a stream.
     """
     _stream = None
+    _cache = None
 
-    def __init__(self, stream: io.TextIOBase):
+    def __init__(self, stream: io.TextIOBase, cache = None):
         self._stream = stream
+        self._cache = cache
         self.reload()
 
     def reload(self):
+        timings = {}
+        t = time.perf_counter()
         # reset the stream to the beginning
         self._stream.seek(0)
-        self._configuration = yaml.safe_load(self._stream)
-        self._dataReloaded()
-
+        content = self._stream.read()
+        timings["read"] = time.perf_counter() - t
+        self._loadSource(content, "yaml", _loadYaml, self._cache, timings)
 
 
 
@@ -0,0 +1,95 @@
+import os, pickle, hashlib, logging
+from typing import Union
+from .. import __version__
+
+
+habloLogger = logging.getLogger("hablo.Config")
+
+# bump this if the layout of the cached objects changes within the same hablo version
+# 2: variables carry a version counter, 3: the variables and references use __slots__, 4: variables keep their raw value
+_CACHE_FORMAT = 4
+
+
+def getDefaultCacheDir() -> str:
+    """
+    Returns the directory hablo caches compiled data in, HABLO_CACHE_DIR or ~/.cache/hablo.
+    """
+    return os.environ.get("HABLO_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "hablo"))
+
+
+class CompiledConfigurationCache:
+    """
+    Stores the parsed and resolved form of configurations on disk, so that workers can skip parsing and resolving.
+    Entries are keyed by the hash of the configuration source and the hablo version.
+    The entries are pickled, so the cache directory must only be writable by trusted users.
+    """
+    _cacheDir : str = ""
+
+    def __init__(self, cacheDir : Union[str, None] = None):
+        if cacheDir is None:
+            cacheDir = getDefaultCacheDir()
+        self._cacheDir = cacheDir
+
+    def getCacheDir(self) -> str:
+        return self._cacheDir
+
+    def _getCacheKey(self, sourceDigest : bytes) -> str:
+        return hashlib.sha256(sourceDigest + ("\0" + __version__ + "\0" + str(_CACHE_FORMAT)).encode("utf-8")).hexdigest()
+
+    def _getCachePath(self, sourceDigest : bytes) -> str:
+        return os.path.join(self._cacheDir, "config-" + self._getCacheKey(sourceDigest) + ".pickle")
+
+    def load(self, sourceDigest : bytes) -> Union[None, tuple]:
+        """
+        Returns the cached state for the given source digest, or None if there is no valid entry.
+        """
+        path = self._getCachePath(sourceDigest)
+        try:
+            with open(path, "rb") as f:
+                entry = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception:
+            habloLogger.warning("Ignoring unreadable configuration cache entry: " + path)
+            return None
+        if not isinstance(entry, tuple) or len(entry) != 4:
+            return None
+        cacheFormat, version, digest, state = entry
+        if cacheFormat != _CACHE_FORMAT or version != __version__ or digest != sourceDigest:
+            return None
+        return state
+
+    def store(self, sourceDigest : bytes, state : tuple):
+        """
+        Stores the state for the given source digest, the entry is replaced atomically.
+        """
+        import tempfile
+        path = self._getCachePath(sourceDigest)
+        try:
+            os.makedirs(self._cacheDir, exist_ok = True)
+            fd, tmpPath = tempfile.mkstemp(dir = self._cacheDir, prefix = ".config-", suffix = ".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    pickle.dump((_CACHE_FORMAT, __version__, sourceDigest, state), f, protocol = pickle.HIGHEST_PROTOCOL)
+                os.replace(tmpPath, path)
+            except:
+                os.unlink(tmpPath)
+                raise
+        except RecursionError:
+            # pickle recurses into the configuration tree, configurations nested this deep are loaded without the cache
+            habloLogger.warning("Configuration is nested too deeply to be cached: " + path)
+        except Exception:
+            habloLogger.warning("Failed to store configuration cache entry: " + path, exc_info = True)
+
+    def clear(self):
+        """
+        Removes all cache entries.
+        """
+        if not os.path.isdir(self._cacheDir):
+            return
+        for name in os.listdir(self._cacheDir):
+            if name.startswith("config-") and name.endswith(".pickle"):
+                try:
+                    os.unlink(os.path.join(self._cacheDir, name))
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,4 @@
+from .instrumentation_base import Span, InstrumentationSink, LoggingSink, PrometheusSink, TraceFileSink, addSink, removeSink, getSinks, isEnabled, startSpan, endSpan
+
+
+__all__ = ['Span', 'InstrumentationSink', 'LoggingSink', 'PrometheusSink', 'TraceFileSink', 'addSink', 'removeSink', 'getSinks', 'isEnabled', 'startSpan', 'endSpan']
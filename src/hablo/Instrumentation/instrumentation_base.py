@@ -0,0 +1,274 @@
+import atexit, json, logging, os, sys, threading, time
+from abc import ABC, abstractmethod
+from typing import Union
+
+
+class Span:
+    """
+    Represents a timed section of work, spans are only created while a sink is registered.
+    """
+    __slots__ = ("_name", "_attributes", "_start", "_end", "_thread", "_task", "_error")
+
+    def __init__(self, name : str, attributes : Union[dict, None] = None):
+        self._name = name
+        self._attributes = attributes if attributes is not None else {}
+        self._thread = threading.get_ident()
+        # asyncio is not imported for this, without it being imported no task can be running
+        asyncioModule = sys.modules.get("asyncio")
+        task = None
+        if asyncioModule is not None:
+            try:
+                task = asyncioModule.current_task()
+            except RuntimeError:
+                pass
+        self._task = None if task is None else id(task)
+        self._error = None
+        self._end = None
+        self._start = time.perf_counter_ns()
+
+    def getName(self) -> str:
+        return self._name
+
+    def getAttributes(self) -> dict:
+        return self._attributes
+
+    def setAttribute(self, key : str, value):
+        self._attributes[key] = value
+
+    def getStart(self) -> int:
+        """
+        Returns the start of the span in nanoseconds of the performance counter.
+        """
+        return self._start
+
+    def getDuration(self) -> float:
+        """
+        Returns the duration of the span in seconds.
+        """
+        end = self._end if self._end is not None else time.perf_counter_ns()
+        return (end - self._start) / 1e9
+
+    def getThread(self) -> int:
+        return self._thread
+
+    def getTask(self) -> Union[int, None]:
+        """
+        Returns an id of the asyncio task the span was started in or None.
+        """
+        return self._task
+
+    def getError(self) -> Union[BaseException, None]:
+        return self._error
+
+    def _finish(self, error : Union[BaseException, None]):
+        self._end = time.perf_counter_ns()
+        self._error = error
+
+
+class InstrumentationSink(ABC):
+    """
+    Base class for the receivers of finished spans.
+    emit() is called from the thread that ended the span, so sinks must be thread-safe.
+    """
+    @abstractmethod
+    def emit(self, span : Span):
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def close(self):
+        pass
+
+
+# the list is replaced instead of modified, so startSpan() can read it without a lock
+_sinks = ()
+_sinksLock = threading.Lock()
+
+def addSink(sink : InstrumentationSink):
+    global _sinks
+    with _sinksLock:
+        if sink not in _sinks:
+            _sinks = _sinks + (sink,)
+
+def removeSink(sink : InstrumentationSink):
+    global _sinks
+    with _sinksLock:
+        _sinks = tuple([s for s in _sinks if s is not sink])
+
+def getSinks() -> tuple:
+    return _sinks
+
+def isEnabled() -> bool:
+    return len(_sinks) > 0
+
+def startSpan(name : str, attributes : Union[dict, None] = None) -> Union[Span, None]:
+    """
+    Starts a span and returns it, or returns None if no sink is registered.
+    Pass the result to endSpan(), so the disabled case costs two function calls.
+    """
+    if not _sinks:
+        return None
+    return Span(name, attributes)
+
+def endSpan(span : Union[Span, None], error : Union[BaseException, None] = None):
+    """
+    Ends a span started with startSpan() and passes it to all sinks.
+    """
+    if span is None:
+        return
+    span._finish(error)
+    for sink in _sinks:
+        try:
+            sink.emit(span)
+        except Exception:
+            logging.getLogger("hablo.Instrumentation").exception("Instrumentation sink failed")
+
+
+class LoggingSink(InstrumentationSink):
+    """
+    Logs every span with its duration and attributes.
+    """
+    def __init__(self, logger : Union[logging.Logger, None] = None, level : int = logging.DEBUG):
+        self._logger = logger if logger is not None else logging.getLogger("hablo.Instrumentation")
+        self._level = level
+
+    def emit(self, span : Span):
+        if not self._logger.isEnabledFor(self._level):
+            return
+        message = span.getName() + " took " + str(round(span.getDuration() * 1000, 3)) + " ms"
+        if span.getAttributes():
+            message += " " + json.dumps(span.getAttributes(), default = str)
+        if span.getError() is not None:
+            message += " failed: " + str(span.getError())
+        self._logger.log(self._level, message)
+
+
+class PrometheusSink(InstrumentationSink):
+    """
+    Aggregates the span durations to histograms and renders them in the Prometheus text format.
+    The histograms are labeled with the span name and the attributes listed in labels.
+    The metrics are kept per process, with several gunicorn workers each worker reports its own.
+    """
+    DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, buckets : Union[tuple, None] = None, labels : tuple = ("node", "type", "channel", "status", "cached")):
+        self._buckets = tuple(sorted(buckets if buckets is not None else self.DEFAULT_BUCKETS))
+        self._labels = labels
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._errors = {}
+        self._collectors = {}
+
+    def _getLabels(self, span : Span) -> tuple:
+        attributes = span.getAttributes()
+        labels = [("span", span.getName())]
+        for label in self._labels:
+            if label in attributes:
+                value = attributes[label]
+                labels.append((label, str(value).lower() if isinstance(value, bool) else str(value)))
+        return tuple(labels)
+
+    def emit(self, span : Span):
+        labels = self._getLabels(span)
+        duration = span.getDuration()
+        with self._lock:
+            histogram = self._histograms.get(labels)
+            if histogram is None:
+                histogram = [[0] * len(self._buckets), 0, 0.0]
+                self._histograms[labels] = histogram
+            counts = histogram[0]
+            for i in range(len(self._buckets)):
+                if duration <= self._buckets[i]:
+                    counts[i] += 1
+            histogram[1] += 1
+            histogram[2] += duration
+            if span.getError() is not None:
+                self._errors[labels] = self._errors.get(labels, 0) + 1
+
+    def addCollector(self, name : str, collect, description : str = ""):
+        """
+        Adds gauges, that are read when the metrics are rendered.
+        collect() returns a dict of label value to number, e.g. the statistics of a cache.
+        """
+        with self._lock:
+            self._collectors[name] = (collect, description)
+
+    @staticmethod
+    def _formatLabels(labels) -> str:
+        return "{" + ",".join([key + "=\"" + value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") + "\"" for key, value in labels]) + "}"
+
+    def render(self) -> str:
+        with self._lock:
+            histograms = [(labels, list(h[0]), h[1], h[2]) for labels, h in self._histograms.items()]
+            errors = list(self._errors.items())
+            collectors = list(self._collectors.items())
+        lines = [
+            "# HELP hablo_span_duration_seconds Duration of instrumented hablo operations.",
+            "# TYPE hablo_span_duration_seconds histogram"
+        ]
+        for labels, counts, count, total in histograms:
+            for i in range(len(self._buckets)):
+                lines.append("hablo_span_duration_seconds_bucket" + self._formatLabels(labels + (("le", repr(self._buckets[i])),)) + " " + str(counts[i]))
+            lines.append("hablo_span_duration_seconds_bucket" + self._formatLabels(labels + (("le", "+Inf"),)) + " " + str(count))
+            lines.append("hablo_span_duration_seconds_count" + self._formatLabels(labels) + " " + str(count))
+            lines.append("hablo_span_duration_seconds_sum" + self._formatLabels(labels) + " " + repr(total))
+        lines.append("# HELP hablo_span_errors_total Instrumented hablo operations that failed.")
+        lines.append("# TYPE hablo_span_errors_total counter")
+        for labels, count in errors:
+            lines.append("hablo_span_errors_total" + self._formatLabels(labels) + " " + str(count))
+        for name, (collect, description) in collectors:
+            metric = "hablo_" + name
+            lines.append("# HELP " + metric + " " + (description if description else name))
+            lines.append("# TYPE " + metric + " gauge")
+            for key, value in collect().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(metric + self._formatLabels((("key", str(key)),)) + " " + repr(value))
+        return "\n".join(lines) + "\n"
+
+
+class TraceFileSink(InstrumentationSink):
+    """
+    Collects the spans as Chrome trace events (chrome://tracing, Perfetto) and writes them to a json file.
+    The file is written by flush() and when the process exits, at most maxEvents spans are kept.
+    """
+    def __init__(self, path : str, maxEvents : int = 1000000):
+        self._path = path
+        self._maxEvents = maxEvents
+        self._lock = threading.Lock()
+        self._events = []
+        self._dropped = 0
+        self._origin = time.perf_counter_ns()
+        atexit.register(self.flush)
+
+    def emit(self, span : Span):
+        # spans of concurrent asyncio tasks overlap on one thread, so every task gets its own track
+        track = span.getTask() if span.getTask() is not None else span.getThread()
+        args = dict(span.getAttributes())
+        if span.getError() is not None:
+            args["error"] = str(span.getError())
+        event = {
+            "name": span.getName(),
+            "cat": span.getName().split(".")[0],
+            "ph": "X",
+            "ts": (span.getStart() - self._origin) / 1000,
+            "dur": span.getDuration() * 1e6,
+            "pid": os.getpid(),
+            "tid": track,
+            "args": args
+        }
+        with self._lock:
+            if len(self._events) >= self._maxEvents:
+                self._dropped += 1
+                return
+            self._events.append(event)
+
+    def flush(self):
+        with self._lock:
+            events = list(self._events)
+            dropped = self._dropped
+        temporaryPath = self._path + "." + str(os.getpid()) + ".tmp"
+        with open(temporaryPath, "w", encoding = "utf-8") as f:
+            json.dump({"traceEvents": events, "otherData": {"droppedEvents": dropped}}, f, default = str)
+        os.replace(temporaryPath, self._path)
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self.flush)
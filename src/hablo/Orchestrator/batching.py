@@ -0,0 +1,160 @@
+import asyncio, inspect, threading, weakref
+from ..Instrumentation import startSpan, endSpan
+
+
+class _BatchQueue:
+    """
+    The calls of one event loop, that wait for the next batch.
+    """
+    def __init__(self):
+        self.calls = []
+        self.timer = None
+        # running batches, the event loop only keeps weak references to its tasks
+        self.tasks = set()
+
+
+class BatchingNodeHandler:
+    """
+    Node handler, that coalesces concurrent calls into one call of a batch-capable handler.
+    Calls are collected until maxBatchSize calls are queued or the first queued call waited maxWaitMs milliseconds,
+    then batchHandler(contexts) is called with the list of node contexts and returns the list of their outputs in the same order.
+    The batch handler can be a coroutine function or a plain function, plain functions are run in the bounded thread pool
+    of the orchestrator, that runs the nodes (NodeContext.getExecutor()).
+    If the batch handler fails, all calls of the batch fail with its exception.
+    Register it like any other handler: setGlobalNodeHandler("llm", BatchingNodeHandler(batchHandler, 32, 10))
+    """
+
+    def __init__(self, batchHandler, maxBatchSize : int = 16, maxWaitMs : float = 5.0):
+        if maxBatchSize < 1:
+            raise ValueError("maxBatchSize must be at least 1")
+        if maxWaitMs < 0:
+            raise ValueError("maxWaitMs must not be negative")
+        self._batchHandler = batchHandler
+        self._maxBatchSize = int(maxBatchSize)
+        self._maxWait = float(maxWaitMs) / 1000.0
+        # one queue per event loop, the channels run one event loop per thread
+        self._queues = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._calls = 0
+        self._batches = 0
+        self._fullBatches = 0
+        self._largestBatch = 0
+        _batchingHandlers.add(self)
+
+    def getMaxBatchSize(self) -> int:
+        return self._maxBatchSize
+
+    def getMaxWaitMs(self) -> float:
+        return self._maxWait * 1000.0
+
+    def getStatistics(self) -> dict:
+        """
+        Returns the calls currently queued and the number and sizes of the batches so far.
+        """
+        with self._lock:
+            return {
+                "queued": self._queued,
+                "calls": self._calls,
+                "batches": self._batches,
+                "fullBatches": self._fullBatches,
+                "largestBatch": self._largestBatch,
+                "averageBatchSize": (self._calls / self._batches) if self._batches > 0 else 0.0
+            }
+
+    def _getQueue(self, loop : asyncio.AbstractEventLoop) -> _BatchQueue:
+        queue = self._queues.get(loop)
+        if queue is None:
+            queue = _BatchQueue()
+            self._queues[loop] = queue
+        return queue
+
+    async def __call__(self, context):
+        loop = asyncio.get_running_loop()
+        queue = self._getQueue(loop)
+        future = loop.create_future()
+        queue.calls.append((context, future))
+        with self._lock:
+            self._queued += 1
+        if len(queue.calls) >= self._maxBatchSize:
+            self._flush(loop, queue)
+        elif queue.timer is None:
+            queue.timer = loop.call_later(self._maxWait, self._flush, loop, queue)
+        try:
+            return await future
+        except asyncio.CancelledError:
+            # calls cancelled while they are queued (e.g. timed out) are not sent to the backend
+            for i in range(len(queue.calls)):
+                if queue.calls[i][1] is future:
+                    del queue.calls[i]
+                    with self._lock:
+                        self._queued -= 1
+                    break
+            if not queue.calls and queue.timer is not None:
+                queue.timer.cancel()
+                queue.timer = None
+            raise
+
+    def _flush(self, loop : asyncio.AbstractEventLoop, queue : _BatchQueue):
+        if queue.timer is not None:
+            queue.timer.cancel()
+            queue.timer = None
+        calls = queue.calls[:self._maxBatchSize]
+        queue.calls = queue.calls[self._maxBatchSize:]
+        if queue.calls:
+            queue.timer = loop.call_later(self._maxWait, self._flush, loop, queue)
+        with self._lock:
+            self._queued -= len(calls)
+        if calls:
+            task = loop.create_task(self._runBatch(loop, calls))
+            queue.tasks.add(task)
+            task.add_done_callback(queue.tasks.discard)
+
+    async def _runBatch(self, loop : asyncio.AbstractEventLoop, calls : list):
+        with self._lock:
+            self._calls += len(calls)
+            self._batches += 1
+            if len(calls) == self._maxBatchSize:
+                self._fullBatches += 1
+            self._largestBatch = max(self._largestBatch, len(calls))
+        contexts = [context for context, future in calls]
+        span = startSpan("orchestrator.batch")
+        if span is not None:
+            span.setAttribute("type", contexts[0].getType())
+            span.setAttribute("size", len(contexts))
+        try:
+            if inspect.iscoroutinefunction(self._batchHandler) or inspect.iscoroutinefunction(getattr(self._batchHandler, "__call__", None)):
+                results = await self._batchHandler(contexts)
+            else:
+                results = await loop.run_in_executor(contexts[0].getExecutor(), self._batchHandler, contexts)
+            if inspect.isawaitable(results):
+                results = await results
+            results = list(results)
+            if len(results) != len(contexts):
+                raise ValueError("The batch handler returned " + str(len(results)) + " outputs for " + str(len(contexts)) + " calls")
+        except Exception as e:
+            endSpan(span, e)
+            for context, future in calls:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        endSpan(span)
+        for (context, future), result in zip(calls, results):
+            if not future.done():
+                future.set_result(result)
+
+
+_batchingHandlers = weakref.WeakSet()
+def getBatchingStatistics() -> dict:
+    """
+    Returns the statistics of all batching handlers summed up, the largest batch is the largest of any handler.
+    """
+    statistics = {"queued": 0, "calls": 0, "batches": 0, "fullBatches": 0, "largestBatch": 0}
+    for handler in list(_batchingHandlers):
+        for key, value in handler.getStatistics().items():
+            if key == "largestBatch":
+                statistics[key] = max(statistics[key], value)
+            elif key in statistics:
+                statistics[key] += value
+    statistics["averageBatchSize"] = (statistics["calls"] / statistics["batches"]) if statistics["batches"] > 0 else 0.0
+    return statistics
@@ -0,0 +1,304 @@
+import threading, weakref
+from typing import Union, List, Tuple, FrozenSet
+from ..Config import RootConfiguration
+from ..Config.config_base import ConfigurationVariableReference
+from ..Instrumentation import startSpan, endSpan
+
+
+class FlowPlan:
+    """
+    Immutable execution plan of a flow.
+    The nodes are ordered topologically and grouped into levels of nodes, that do not depend on each other.
+    """
+
+    def __init__(self, inputs : List[str], outputs : List[str], nodeTypes : dict, dependencies : dict, variableDependents : dict, outputDependencies : set, streamedOutputs : Union[dict, None] = None, templateVariables : Union[dict, None] = None, templateSegments : Union[dict, None] = None):
+        self._inputs = tuple(inputs)
+        self._outputs = tuple(outputs)
+        self._nodeTypes = dict(nodeTypes)
+        self._dependencies = {}
+        self._dependents = {}
+        for name in nodeTypes:
+            self._dependencies[name] = frozenset(dependencies.get(name, ()))
+            self._dependents[name] = set()
+        for name in self._dependencies:
+            for dependency in self._dependencies[name]:
+                self._dependents[dependency].add(name)
+        for name in self._dependents:
+            self._dependents[name] = frozenset(self._dependents[name])
+        self._variableDependents = {}
+        for variableName in variableDependents:
+            self._variableDependents[variableName] = frozenset(variableDependents[variableName])
+        self._outputDependencies = frozenset(outputDependencies)
+        self._streamedOutputs = dict(streamedOutputs or {})
+        self._templateVariables = {}
+        for name in (templateVariables or {}):
+            self._templateVariables[name] = frozenset(templateVariables[name])
+        self._templateSegments = {}
+        for name in (templateSegments or {}):
+            self._templateSegments[name] = tuple(templateSegments[name])
+        self._levels = self._computeLevels()
+        order = []
+        for level in self._levels:
+            order.extend(level)
+        self._order = tuple(order)
+
+    def _computeLevels(self) -> Tuple[Tuple[str, ...], ...]:
+        levels = []
+        remaining = dict(self._dependencies)
+        done = set()
+        while remaining:
+            level = [name for name in remaining if remaining[name].issubset(done)]
+            if len(level) == 0:
+                raise ValueError("Cyclic node dependencies found: " + " -> ".join(self._findCycle(remaining)))
+            for name in level:
+                del remaining[name]
+            done.update(level)
+            levels.append(tuple(level))
+        return tuple(levels)
+
+    def _findCycle(self, remaining : dict) -> List[str]:
+        # every remaining node depends on another remaining node, so following them must end in a cycle
+        path = []
+        seen = {}
+        name = next(iter(remaining))
+        while name not in seen:
+            seen[name] = len(path)
+            path.append(name)
+            name = sorted([x for x in remaining[name] if x in remaining])[0]
+        return path[seen[name]:] + [name]
+
+    def getInputs(self) -> Tuple[str, ...]:
+        return self._inputs
+
+    def getOutputs(self) -> Tuple[str, ...]:
+        return self._outputs
+
+    def getNodes(self) -> Tuple[str, ...]:
+        """
+        Returns all nodes in topological order.
+        """
+        return self._order
+
+    def getLevels(self) -> Tuple[Tuple[str, ...], ...]:
+        """
+        Returns the nodes grouped into levels, the nodes of a level only depend on nodes of earlier levels.
+        """
+        return self._levels
+
+    def getNodeType(self, nodeName : str) -> str:
+        return self._nodeTypes[nodeName]
+
+    def getDependencies(self, nodeName : str) -> FrozenSet[str]:
+        """
+        Returns the nodes, whose output the given node references.
+        """
+        return self._dependencies[nodeName]
+
+    def getDependents(self, nodeName : str) -> FrozenSet[str]:
+        """
+        Returns the nodes, that reference the output of the given node.
+        """
+        return self._dependents[nodeName]
+
+    def getVariableDependents(self, variableName : str) -> FrozenSet[str]:
+        """
+        Returns the nodes, that directly reference the given variable (e.g. inputs.question).
+        """
+        return self._variableDependents.get(variableName, frozenset())
+
+    def getTemplateVariables(self, nodeName : str) -> FrozenSet[str]:
+        """
+        Returns the variables read by the "template" setting of the given node.
+        """
+        return self._templateVariables.get(nodeName, frozenset())
+
+    def getTemplateSegments(self, nodeName : str) -> Union[Tuple[tuple, ...], None]:
+        """
+        Returns the ("text", text), ("variable", name) and ("node", name) segments of a template, that can be rendered
+        while the outputs of the nodes it reads are produced, or None if the template can only be rendered as a whole.
+        """
+        return self._templateSegments.get(nodeName)
+
+    def getOutputDependencies(self) -> FrozenSet[str]:
+        """
+        Returns the nodes, whose output is referenced by the flow outputs.
+        """
+        return self._outputDependencies
+
+    def getStreamedOutputs(self) -> dict:
+        """
+        Returns the flow outputs, that are the whole output of a node, mapped to that node.
+        These outputs can be streamed while the node produces its output.
+        """
+        return dict(self._streamedOutputs)
+
+
+class FlowPlanner:
+    _inputs = []
+    _nodes = []
+    _outputs = []
+
+    def __init__(self, configuration : RootConfiguration):
+        configData, resolver = configuration._getState()
+        if not isinstance(configData, dict):
+            raise ValueError("The configuration must be a mapping")
+        self._configData = configData
+        self._resolver = resolver
+        span = startSpan("orchestrator.plan")
+        try:
+            self._setInputs(configuration)
+            self._setOutputs(configuration)
+            self._setNodes(configuration)
+            self._plan = self._compile()
+        except ValueError as e:
+            endSpan(span, e)
+            raise
+        endSpan(span)
+
+    def _setInputs(self, configuration : RootConfiguration):
+        self._inputs = []
+        if "inputs" not in self._configData:
+            raise ValueError("No inputs found in configuration")
+        if isinstance(self._configData["inputs"], dict):
+            self._inputs = list(self._configData["inputs"])
+        
+        if len(self._inputs) == 0:
+            raise ValueError("No inputs found in configuration")
+    
+
+    def _setOutputs(self, configuration : RootConfiguration):
+        self._outputs = []
+        if "outputs" not in self._configData:
+            raise ValueError("No outputs found in configuration")
+        if isinstance(self._configData["outputs"], dict):
+            self._outputs = list(self._configData["outputs"])
+        
+        if len(self._outputs) == 0:
+            raise ValueError("No outputs found in configuration")
+    
+
+    def _setNodes(self, configuration : RootConfiguration):
+        self._nodes = []
+        if "nodes" not in self._configData:
+            raise ValueError("No nodes found in configuration")
+        if isinstance(self._configData["nodes"], dict):
+            self._nodes = list(self._configData["nodes"])
+        
+        if len(self._nodes) == 0:
+            raise ValueError("No nodes found in configuration")
+
+    def _getReferencedVariables(self, configData) -> set:
+        variables = set()
+        stack = [configData]
+        while stack:
+            val = stack.pop()
+            if isinstance(val, ConfigurationVariableReference):
+                if self._resolver is not None:
+                    variableName = self._resolver._resolveParentVariable(val.getName())
+                    if variableName is not None:
+                        variables.add(variableName)
+            elif isinstance(val, dict):
+                stack.extend(val.values())
+            elif isinstance(val, list):
+                stack.extend(val)
+        return variables
+
+    def _getTemplateVariables(self, nodeName : str, nodeData, variableNames : list) -> set:
+        """
+        Returns the variables read by the "template" setting of a node, e.g. {{ nodes.search.output }}.
+        """
+        variables = set()
+        if not isinstance(nodeData, dict) or not isinstance(nodeData.get("template"), str):
+            return variables
+        # jinja2 is only imported by flows that use templates
+        from ..Templates import getTemplateReferences
+        for path in getTemplateReferences(nodeData["template"], "nodes." + str(nodeName) + ".template"):
+            for variableName in variableNames:
+                # {{ nodes.a }} reads all variables below it, {{ nodes.a.output.text }} reads nodes.a.output
+                if variableName == path or variableName.startswith(path + ".") or path.startswith(variableName + "."):
+                    variables.add(variableName)
+        return variables
+
+    def _getTemplateSegments(self, nodeName : str, nodeData, variableNames : set, outputVariables : dict) -> Union[tuple, None]:
+        """
+        Returns the segments of a template, that only outputs text, variables and whole node outputs, or None.
+        """
+        if not isinstance(nodeData, dict) or not isinstance(nodeData.get("template"), str):
+            return None
+        from ..Templates import getTemplateSegments
+        segments = getTemplateSegments(nodeData["template"], "nodes." + str(nodeName) + ".template")
+        if segments is None:
+            return None
+        result = []
+        for text, path in segments:
+            if path is None:
+                result.append(("text", text))
+            elif path in outputVariables:
+                result.append(("node", outputVariables[path]))
+            elif path in variableNames:
+                result.append(("variable", path))
+            else:
+                # parts of a value or unknown names are only rendered by jinja
+                return None
+        return tuple(result)
+
+    def _compile(self) -> FlowPlan:
+        outputVariables = {}
+        nodeTypes = {}
+        for name in self._nodes:
+            outputVariables["nodes." + str(name) + ".output"] = name
+            node = self._configData["nodes"][name]
+            if not isinstance(node, dict) or "type" not in node:
+                raise ValueError("No type found for node: " + str(name))
+            nodeTypes[name] = str(node["type"]).lower().strip()
+
+        variableNames = [] if self._resolver is None else [variable.getName() for variable in self._resolver.getVariables()]
+        dependencies = {}
+        variableDependents = {}
+        templateVariables = {}
+        templateSegments = {}
+        variableNameSet = set(variableNames)
+        for name in self._nodes:
+            dependencies[name] = set()
+            nodeData = self._configData["nodes"][name]
+            templateVariables[name] = self._getTemplateVariables(name, nodeData, variableNames)
+            segments = self._getTemplateSegments(name, nodeData, variableNameSet, outputVariables)
+            if segments is not None:
+                templateSegments[name] = segments
+            for variableName in self._getReferencedVariables(nodeData) | templateVariables[name]:
+                variableDependents.setdefault(variableName, set()).add(name)
+                if variableName in outputVariables:
+                    dependencies[name].add(outputVariables[variableName])
+        outputDependencies = set()
+        for variableName in self._getReferencedVariables(self._configData["outputs"]):
+            if variableName in outputVariables:
+                outputDependencies.add(outputVariables[variableName])
+        streamedOutputs = {}
+        for name in self._outputs:
+            val = self._configData["outputs"][name]
+            if isinstance(val, ConfigurationVariableReference) and val.getName() in outputVariables:
+                streamedOutputs[name] = outputVariables[val.getName()]
+        return FlowPlan(self._inputs, self._outputs, nodeTypes, dependencies, variableDependents, outputDependencies, streamedOutputs, templateVariables, templateSegments)
+
+    def getPlan(self) -> FlowPlan:
+        return self._plan
+
+
+_flowPlans = weakref.WeakKeyDictionary()
+_flowPlansLock = threading.Lock()
+def getFlowPlan(configuration : RootConfiguration) -> FlowPlan:
+    """
+    Returns the execution plan of the currently loaded configuration.
+    The plan is compiled once per configuration load and shared afterwards.
+    """
+    configData, resolver = configuration._getState()
+    if resolver is None:
+        return FlowPlanner(configuration).getPlan()
+    with _flowPlansLock:
+        entry = _flowPlans.get(resolver)
+    if entry is not None and entry[0] is configData:
+        return entry[1]
+    plan = FlowPlanner(configuration).getPlan()
+    with _flowPlansLock:
+        _flowPlans[resolver] = (configData, plan)
+    return plan
@@ -0,0 +1,143 @@
+import asyncio, copy, threading
+from typing import Union
+from ..Config import VariableScope
+from .flow_planner import FlowPlan
+from .orchestrator_base import Orchestrator
+
+
+class FlowSession:
+    """
+    Keeps the variable scope and the node outputs of a conversation between its turns.
+    Setting a variable marks the nodes that reference it, and all nodes downstream of them, as dirty.
+    A turn only runs the dirty nodes and reuses the outputs of the previous turns for all other nodes,
+    so node handlers must return the same output for the same node configuration.
+    Turns of one session run one after the other, use one session per conversation.
+    """
+
+    def __init__(self, orchestrator : Orchestrator):
+        self._orchestrator = orchestrator
+        self._lock = threading.Lock()
+        self._running = False
+        self._variableValues = {}
+        self._reset(orchestrator.getPlan())
+
+    def _reset(self, plan : FlowPlan):
+        """
+        Starts over with a new plan (e.g. after the configuration was reloaded), the variables set so far are kept.
+        """
+        self._plan = plan
+        self._scope = self._orchestrator.createScope()
+        self._scope.setVariables(self._variableValues)
+        self._dirty = set(plan.getNodes())
+
+    def getPlan(self) -> FlowPlan:
+        return self._plan
+
+    def getScope(self) -> VariableScope:
+        return self._scope
+
+    def getDirtyNodes(self) -> set:
+        """
+        Returns the nodes the next turn runs.
+        """
+        return set(self._dirty)
+
+    def _markDirty(self, nodes):
+        stack = list(nodes)
+        while stack:
+            nodeName = stack.pop()
+            if nodeName in self._dirty:
+                continue
+            self._dirty.add(nodeName)
+            stack.extend(self._plan.getDependents(nodeName))
+
+    def setVariable(self, variableName : str, value) -> bool:
+        """
+        Sets a variable of the session, the nodes depending on it run in the next turn if its value changed.
+        Returns False if the variable is not defined.
+        """
+        variable = None if self._scope.getVariableResolver() is None else self._scope.getVariableResolver().getVariable(variableName)
+        if variable is None:
+            return False
+        if variable.convertValue(value) == self._scope.getVariableValue(variableName):
+            self._variableValues[variable.getName()] = value
+            return True
+        self._scope.setVariable(variableName, value)
+        self._variableValues[variable.getName()] = value
+        self._markDirty(self._plan.getVariableDependents(variable.getName()))
+        return True
+
+    def setInputs(self, inputs : dict):
+        """
+        Sets the flow inputs of the next turn, inputs that are not given keep their previous value.
+        """
+        for key in inputs:
+            if not self._scope.hasVariable("inputs." + str(key)):
+                raise ValueError("Unknown flow input: " + str(key))
+        for key in inputs:
+            self.setVariable("inputs." + str(key), inputs[key])
+
+    def _beginTurn(self, inputs : Union[dict, None]) -> set:
+        with self._lock:
+            if self._running:
+                raise RuntimeError("A turn of this session is already running")
+            self._running = True
+        try:
+            plan = self._orchestrator.getPlan()
+            if plan is not self._plan:
+                self._reset(plan)
+            if inputs:
+                self.setInputs(inputs)
+        except BaseException:
+            self._endTurn(False)
+            raise
+        return set(self._dirty)
+
+    def _endTurn(self, succeeded : bool, nodes : Union[set, None] = None):
+        # after a failed turn the nodes stay dirty, so the next turn runs them again
+        if succeeded:
+            self._dirty.difference_update(nodes)
+        with self._lock:
+            self._running = False
+
+    async def runAsync(self, inputs : Union[dict, None] = None, priority : int = 0, deadline : Union[float, None] = None) -> dict:
+        """
+        Runs a turn and returns the flow outputs, the turn is admitted like in Orchestrator.runAsync().
+        """
+        nodes = self._beginTurn(inputs)
+        succeeded = False
+        try:
+            ticket = await self._orchestrator._admit(priority, deadline)
+            try:
+                await self._orchestrator._execute(self._plan, self._scope, nodes = nodes)
+            finally:
+                self._orchestrator._release(ticket)
+            succeeded = True
+        finally:
+            self._endTurn(succeeded, nodes)
+        return copy.deepcopy(self._scope.getNativeConfiguration("outputs"))
+
+    async def streamAsync(self, inputs : Union[dict, None] = None, priority : int = 0, deadline : Union[float, None] = None):
+        """
+        Runs a turn and yields its output like Orchestrator.streamAsync(), outputs of nodes that do not run again
+        are only part of the last item.
+        """
+        nodes = self._beginTurn(inputs)
+        succeeded = False
+        try:
+            ticket = await self._orchestrator._admit(priority, deadline)
+            try:
+                async for event in self._orchestrator._streamExecution(self._plan, self._scope, nodes):
+                    if "outputs" in event:
+                        succeeded = True
+                    yield event
+            finally:
+                self._orchestrator._release(ticket)
+        finally:
+            self._endTurn(succeeded, nodes)
+
+    def run(self, inputs : Union[dict, None] = None) -> dict:
+        """
+        Runs a turn on a new event loop, use runAsync() if an event loop is already running.
+        """
+        return asyncio.run(self.runAsync(inputs))
@@ -0,0 +1,187 @@
+import hashlib, json, os, pickle, sqlite3, threading, time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Union, Tuple
+
+
+def getNodeCacheKey(nodeType : str, nodeConfiguration, variableValues : Union[dict, None] = None) -> str:
+    """
+    Returns the cache key of a node call, which is built from the node type, the resolved node configuration
+    and the values of the variables the node reads otherwise (e.g. in its template).
+    """
+    if isinstance(nodeConfiguration, dict):
+        # settings that do not change the output of the node are not part of the key
+        nodeConfiguration = {k: v for k, v in nodeConfiguration.items() if k not in ("cache", "timeout")}
+    data = json.dumps([nodeType, nodeConfiguration, variableValues or {}], sort_keys = True, default = repr, separators = (",", ":"))
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class NodeCache(ABC):
+    """
+    Base class for caches of node outputs.
+    Entries are evicted in least recently used order once maxEntries is reached and expire after ttl seconds.
+    """
+    _blocking = False
+
+    def __init__(self, maxEntries : int = 1024, ttl : Union[float, None] = None):
+        self._maxEntries = maxEntries
+        self._ttl = ttl
+        self._statsLock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+
+    def isBlocking(self) -> bool:
+        """
+        Returns True if the cache does blocking I/O, the orchestrator then accesses it from its thread pool.
+        """
+        return self._blocking
+
+    def getDefaultTtl(self) -> Union[float, None]:
+        return self._ttl
+
+    def _count(self, hits : int = 0, misses : int = 0, evictions : int = 0, expirations : int = 0):
+        with self._statsLock:
+            self._hits += hits
+            self._misses += misses
+            self._evictions += evictions
+            self._expirations += expirations
+
+    @abstractmethod
+    def get(self, key : str) -> Tuple[bool, object]:
+        """
+        Returns (True, value) for a cached entry and (False, None) otherwise.
+        """
+        raise NotImplementedError("Subclasses must implement this method")
+
+    @abstractmethod
+    def set(self, key : str, value, ttl : Union[float, None] = None):
+        raise NotImplementedError("Subclasses must implement this method")
+
+    @abstractmethod
+    def clear(self):
+        raise NotImplementedError("Subclasses must implement this method")
+
+    @abstractmethod
+    def getSize(self) -> int:
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def getStatistics(self) -> dict:
+        with self._statsLock:
+            stats = {
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+                "expirations": self._expirations
+            }
+        stats["entries"] = self.getSize()
+        return stats
+
+
+class MemoryNodeCache(NodeCache):
+    """
+    In-process node output cache.
+    """
+
+    def __init__(self, maxEntries : int = 1024, ttl : Union[float, None] = None):
+        super().__init__(maxEntries, ttl)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, key : str) -> Tuple[bool, object]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] <= time.monotonic():
+                del self._entries[key]
+                entry = None
+                self._count(expirations = 1)
+            if entry is None:
+                self._count(misses = 1)
+                return (False, None)
+            self._entries.move_to_end(key)
+            self._count(hits = 1)
+            return (True, entry[1])
+
+    def set(self, key : str, value, ttl : Union[float, None] = None):
+        if ttl is None:
+            ttl = self._ttl
+        with self._lock:
+            self._entries[key] = (None if ttl is None else time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._maxEntries:
+                self._entries.popitem(last = False)
+                self._count(evictions = 1)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def getSize(self) -> int:
+        return len(self._entries)
+
+
+class SqliteNodeCache(NodeCache):
+    """
+    Node output cache in a local sqlite database, that can be shared by all workers on a host.
+    The values are pickled, so the database must only be writable by trusted users.
+    The hit, miss and eviction counters are per process.
+    """
+    _blocking = True
+
+    def __init__(self, path : str, maxEntries : int = 100000, ttl : Union[float, None] = None):
+        super().__init__(maxEntries, ttl)
+        self._path = path
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok = True)
+        with self._getConnection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS hablo_node_cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL, accessed REAL NOT NULL)")
+            connection.execute("CREATE INDEX IF NOT EXISTS hablo_node_cache_accessed ON hablo_node_cache (accessed)")
+
+    def _getConnection(self) -> sqlite3.Connection:
+        # sqlite connections must not be shared between threads, so every thread (and forked worker) opens its own
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self._path, timeout = 30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, key : str) -> Tuple[bool, object]:
+        now = time.time()
+        connection = self._getConnection()
+        with connection:
+            row = connection.execute("SELECT value, expires FROM hablo_node_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[1] is not None and row[1] <= now:
+                connection.execute("DELETE FROM hablo_node_cache WHERE key = ?", (key,))
+                self._count(expirations = 1)
+                row = None
+            if row is None:
+                self._count(misses = 1)
+                return (False, None)
+            connection.execute("UPDATE hablo_node_cache SET accessed = ? WHERE key = ?", (now, key))
+        self._count(hits = 1)
+        return (True, pickle.loads(row[0]))
+
+    def set(self, key : str, value, ttl : Union[float, None] = None):
+        if ttl is None:
+            ttl = self._ttl
+        now = time.time()
+        connection = self._getConnection()
+        with connection:
+            connection.execute("INSERT OR REPLACE INTO hablo_node_cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)", (key, pickle.dumps(value, protocol = pickle.HIGHEST_PROTOCOL), None if ttl is None else now + ttl, now))
+            size = connection.execute("SELECT COUNT(*) FROM hablo_node_cache").fetchone()[0]
+            if size > self._maxEntries:
+                evicted = connection.execute("DELETE FROM hablo_node_cache WHERE key IN (SELECT key FROM hablo_node_cache ORDER BY accessed LIMIT ?)", (size - self._maxEntries,)).rowcount
+                self._count(evictions = evicted)
+
+    def clear(self):
+        connection = self._getConnection()
+        with connection:
+            connection.execute("DELETE FROM hablo_node_cache")
+
+    def getSize(self) -> int:
+        return self._getConnection().execute("SELECT COUNT(*) FROM hablo_node_cache").fetchone()[0]
@@ -0,0 +1,546 @@
+import asyncio, copy, functools, inspect, threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Union
+from ..Config import RootConfiguration, VariableScope
+from .flow_planner import FlowPlan, getFlowPlan
+from .node_cache import NodeCache, getNodeCacheKey
+from .scheduler import AdmissionScheduler, AdmissionTicket
+from ..Instrumentation import Span, startSpan, endSpan
+
+
+class NodeExecutionError(RuntimeError):
+    """
+    Raised when a node of a flow cannot be executed.
+    """
+    def __init__(self, nodeName : str, message : str):
+        super().__init__("Node \"" + str(nodeName) + "\" failed: " + message)
+        self._nodeName = nodeName
+
+    def getNodeName(self) -> str:
+        return self._nodeName
+
+
+class NodeStream:
+    """
+    Buffers the output chunks of a node, every consumer iterates all chunks from the beginning.
+    Nodes whose handler returns a plain value produce a stream with that value as single chunk.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._closed = False
+        self._error = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        changed = self._changed
+        self._changed = asyncio.Event()
+        changed.set()
+
+    def append(self, chunk):
+        self._chunks.append(chunk)
+        self._notify()
+
+    def close(self):
+        self._closed = True
+        self._notify()
+
+    def fail(self, error : BaseException):
+        self._error = error
+        self._closed = True
+        self._notify()
+
+    def isClosed(self) -> bool:
+        return self._closed
+
+    def getChunks(self) -> list:
+        return list(self._chunks)
+
+    async def iterate(self):
+        i = 0
+        while True:
+            while i < len(self._chunks):
+                yield self._chunks[i]
+                i = i + 1
+            if self._closed:
+                if self._error is not None:
+                    raise self._error
+                return
+            await self._changed.wait()
+
+    def __aiter__(self):
+        return self.iterate()
+
+
+class NodeContext:
+    """
+    Is passed to node handlers and gives access to the node and the variable scope of the current run.
+    """
+
+    def __init__(self, nodeName : str, nodeType : str, scope : VariableScope, streams : Union[dict, None] = None, getExecutor = None):
+        """
+        getExecutor returns the thread pool for synchronous handler code, it is only called when the pool is needed.
+        """
+        self._nodeName = nodeName
+        self._nodeType = nodeType
+        self._scope = scope
+        self._streams = streams if streams is not None else {}
+        self._getExecutor = getExecutor
+        self._configuration = None
+
+    def getName(self) -> str:
+        return self._nodeName
+
+    def getType(self) -> str:
+        return self._nodeType
+
+    def getScope(self) -> VariableScope:
+        return self._scope
+
+    def getExecutor(self) -> Union[Executor, None]:
+        """
+        Returns the bounded thread pool of the orchestrator, that runs synchronous handlers, or None to use the default executor.
+        """
+        if self._getExecutor is None:
+            return None
+        return self._getExecutor()
+
+    def getConfiguration(self) -> dict:
+        """
+        Returns the node configuration with all variable references replaced by their values in this run.
+        The returned data is shared and must not be modified.
+        """
+        if self._configuration is None:
+            self._configuration = self._scope.getNativeConfiguration("nodes." + str(self._nodeName))
+        return self._configuration
+
+    def renderTemplate(self, extraContext : Union[dict, None] = None) -> str:
+        """
+        Renders the "template" setting of the node with the variable values of this run.
+        The template is compiled once per configuration load.
+        """
+        # jinja2 is only imported by flows that use templates
+        from ..Templates import getNodeTemplates
+        return getNodeTemplates(self._scope).render(self._nodeName, self._scope, extraContext)
+
+    def getInputStream(self, nodeName : str) -> NodeStream:
+        """
+        Returns the output stream of a node this node depends on.
+        Handlers registered with streamingInputs use it to consume the output while it is produced.
+        """
+        if nodeName not in self._streams:
+            raise NodeExecutionError(self._nodeName, "Node has not been started: " + str(nodeName))
+        return self._streams[nodeName]
+
+
+_globalNodeTypeHandlers = {}
+_globalStreamingNodeTypes = set()
+def setGlobalNodeHandler(typeName : str, handler, streamingInputs : bool = False):
+    """
+    Registers the handler for a node type.
+    Handlers can return their output or yield it in chunks as async generator.
+    With streamingInputs the node is started as soon as the nodes it depends on started
+    and reads their output with NodeContext.getInputStream().
+    """
+    typeName = str(typeName).lower().strip()
+    if typeName in _globalNodeTypeHandlers:
+        raise ValueError("Node type handler already exists for type: " + typeName)
+    _globalNodeTypeHandlers[typeName] = handler
+    if streamingInputs:
+        _globalStreamingNodeTypes.add(typeName)
+
+
+async def _renderTemplateNode(context : NodeContext) -> str:
+    return context.renderTemplate()
+
+async def _streamTemplateNode(context : NodeContext, segments : tuple):
+    """
+    Renders the segments of a template (see FlowPlan.getTemplateSegments) and passes the string chunks
+    of the node outputs it reads through while they are produced.
+    """
+    for kind, value in segments:
+        if kind == "text":
+            if value:
+                yield value
+        elif kind == "variable":
+            yield str(context.getScope().getVariableValue(value))
+        else:
+            passed = False
+            chunks = []
+            async for chunk in context.getInputStream(value):
+                if isinstance(chunk, str) and not chunks:
+                    passed = True
+                    yield chunk
+                else:
+                    chunks.append(chunk)
+            if chunks and not passed:
+                # a plain value or a stream of other chunks is rendered with str() like jinja does
+                yield str(chunks[0] if len(chunks) == 1 else chunks)
+            elif chunks:
+                yield "".join([str(x) for x in chunks])
+
+# handlers of the node types hablo provides itself, registered handlers take precedence
+_builtinNodeTypeHandlers = {
+    "template": _renderTemplateNode
+}
+
+
+def _isAsyncHandler(handler) -> bool:
+    return inspect.iscoroutinefunction(handler) or inspect.iscoroutinefunction(getattr(handler, "__call__", None))
+
+
+class Orchestrator:
+    """
+    Executes the nodes of a flow on an asyncio event loop.
+    Nodes are started as soon as the nodes they depend on finished, so independent nodes run concurrently.
+    Handlers can be coroutine functions or plain functions, plain functions are run in a bounded thread pool.
+    """
+    _configuration : RootConfiguration = None
+
+    def __init__(self, configuration : RootConfiguration, maxConcurrency : int = 16, maxThreads : int = 8, nodeTimeout : Union[float, None] = None):
+        """
+        maxConcurrency limits the nodes running at the same time within a run,
+        maxThreads limits the threads used for synchronous handlers and
+        nodeTimeout is the default timeout in seconds for nodes without a "timeout" setting.
+        """
+        self._configuration = configuration
+        self._maxConcurrency = maxConcurrency
+        self._maxThreads = maxThreads
+        self._nodeTimeout = nodeTimeout
+        self._nodeTypeHandlers = {}
+        self._streamingNodeTypes = {}
+        self._nodeCache = None
+        self._executor = None
+        self._executorLock = threading.Lock()
+        self._scheduler = AdmissionScheduler.fromConfiguration(configuration)
+        self._flowName = "default"
+
+    def setConfiguration(self, configuration : RootConfiguration):
+        self._configuration = configuration
+
+    def getConfiguration(self) -> RootConfiguration:
+        return self._configuration
+
+    def setNodeHandler(self, typeName : str, handler, streamingInputs : bool = False):
+        """
+        Sets a handler for a node type, that is only used by this orchestrator and takes precedence over global handlers.
+        """
+        typeName = str(typeName).lower().strip()
+        self._nodeTypeHandlers[typeName] = handler
+        self._streamingNodeTypes[typeName] = streamingInputs
+
+    def hasStreamingInputs(self, typeName : str) -> bool:
+        typeName = str(typeName).lower().strip()
+        if typeName in self._nodeTypeHandlers:
+            return self._streamingNodeTypes[typeName]
+        return typeName in _globalStreamingNodeTypes
+
+    def _hasStreamingInputs(self, plan : FlowPlan, nodeName : str) -> bool:
+        nodeType = plan.getNodeType(nodeName)
+        # the builtin handler streams templates, that only output text, variables and whole node outputs
+        if self.getNodeHandler(nodeType) is _renderTemplateNode:
+            return plan.getTemplateSegments(nodeName) is not None
+        return self.hasStreamingInputs(nodeType)
+
+    def getNodeHandler(self, typeName : str):
+        typeName = str(typeName).lower().strip()
+        if typeName in self._nodeTypeHandlers:
+            return self._nodeTypeHandlers[typeName]
+        if typeName in _globalNodeTypeHandlers:
+            return _globalNodeTypeHandlers[typeName]
+        return _builtinNodeTypeHandlers.get(typeName)
+
+    def setNodeCache(self, nodeCache : Union[NodeCache, None]):
+        """
+        Sets the cache for the outputs of nodes, that enable it with "cache: true" or "cache: {ttl: seconds}".
+        Nodes with streaming inputs, that depend on other nodes, are never cached.
+        """
+        self._nodeCache = nodeCache
+
+    def getNodeCache(self) -> Union[NodeCache, None]:
+        return self._nodeCache
+
+    def setScheduler(self, scheduler : Union[AdmissionScheduler, None], flowName : str = "default"):
+        """
+        Sets the scheduler, that admits the runs of this orchestrator, several orchestrators can share one scheduler.
+        By default the scheduler is created from the scheduler section of the configuration.
+        """
+        self._scheduler = scheduler
+        self._flowName = str(flowName)
+
+    def getScheduler(self) -> Union[AdmissionScheduler, None]:
+        return self._scheduler
+
+    def getPlan(self) -> FlowPlan:
+        return getFlowPlan(self._configuration)
+
+    async def _admit(self, priority : int, deadline : Union[float, None]) -> Union[AdmissionTicket, None]:
+        if self._scheduler is None:
+            return None
+        return await self._scheduler.acquire(self._flowName, priority, deadline)
+
+    def _release(self, ticket : Union[AdmissionTicket, None]):
+        if ticket is not None:
+            self._scheduler.release(ticket)
+
+    def _getExecutor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._executorLock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers = self._maxThreads, thread_name_prefix = "hablo-node")
+        return self._executor
+
+    def close(self):
+        """
+        Shuts down the thread pool used for synchronous handlers.
+        """
+        with self._executorLock:
+            executor = self._executor
+            self._executor = None
+        if executor is not None:
+            executor.shutdown(wait = True)
+
+    def createScope(self, inputs : Union[dict, None] = None) -> VariableScope:
+        """
+        Creates the variable scope of a run and sets the given flow inputs.
+        """
+        scope = self._configuration.createScope()
+        if inputs:
+            values = {}
+            for key in inputs:
+                variableName = "inputs." + str(key)
+                if not scope.hasVariable(variableName):
+                    raise ValueError("Unknown flow input: " + str(key))
+                values[variableName] = inputs[key]
+            scope.setVariables(values)
+        return scope
+
+    async def _callHandler(self, handler, context : NodeContext, stream : NodeStream):
+        if inspect.isasyncgenfunction(handler) or _isAsyncHandler(handler):
+            result = handler(context)
+        else:
+            result = await asyncio.get_running_loop().run_in_executor(self._getExecutor(), handler, context)
+        if inspect.isawaitable(result):
+            result = await result
+        if not hasattr(result, "__aiter__"):
+            stream.append(result)
+            return result
+        async for chunk in result:
+            stream.append(chunk)
+        chunks = stream.getChunks()
+        if all([isinstance(x, str) for x in chunks]):
+            return "".join(chunks)
+        return chunks
+
+    async def _accessNodeCache(self, method, *args):
+        if self._nodeCache.isBlocking():
+            return await asyncio.get_running_loop().run_in_executor(self._getExecutor(), method, *args)
+        return method(*args)
+
+    def _getNodeCacheSettings(self, nodeConfiguration) -> Union[None, dict]:
+        """
+        Returns the cache settings of a node or None, if the node does not use the cache.
+        """
+        if self._nodeCache is None or not isinstance(nodeConfiguration, dict):
+            return None
+        settings = nodeConfiguration.get("cache")
+        if settings is True:
+            return {}
+        if isinstance(settings, dict) and settings.get("enabled", True):
+            return settings
+        return None
+
+    async def _callCachedHandler(self, handler, context : NodeContext, stream : NodeStream, plan : FlowPlan, span : Union[Span, None] = None):
+        settings = self._getNodeCacheSettings(context.getConfiguration())
+        # nodes with streaming inputs start before the outputs they reference are set, so their configuration is no valid key
+        if settings is None or (self._hasStreamingInputs(plan, context.getName()) and plan.getDependencies(context.getName())):
+            return await self._callHandler(handler, context, stream)
+        # the template is rendered from variables, that are not substituted in the node configuration
+        variableValues = {}
+        for variableName in plan.getTemplateVariables(context.getName()):
+            variableValues[variableName] = context.getScope().getVariableValue(variableName)
+        key = getNodeCacheKey(context.getType(), context.getConfiguration(), variableValues)
+        found, result = await self._accessNodeCache(self._nodeCache.get, key)
+        if span is not None:
+            span.setAttribute("cached", found)
+        if found:
+            stream.append(result)
+            return result
+        result = await self._callHandler(handler, context, stream)
+        ttl = settings.get("ttl")
+        await self._accessNodeCache(self._nodeCache.set, key, result, None if ttl is None else float(ttl))
+        return result
+
+    async def _runNode(self, nodeName : str, plan : FlowPlan, scope : VariableScope, semaphore : asyncio.Semaphore, streams : dict):
+        nodeType = plan.getNodeType(nodeName)
+        handler = self.getNodeHandler(nodeType)
+        if handler is _renderTemplateNode and plan.getTemplateSegments(nodeName) is not None:
+            handler = functools.partial(_streamTemplateNode, segments = plan.getTemplateSegments(nodeName))
+        stream = streams[nodeName]
+        try:
+            if handler is None:
+                raise NodeExecutionError(nodeName, "No handler registered for node type: " + nodeType)
+            context = NodeContext(nodeName, nodeType, scope, streams, self._getExecutor)
+            timeout = self._nodeTimeout
+            nodeConfiguration = context.getConfiguration()
+            if isinstance(nodeConfiguration, dict) and nodeConfiguration.get("timeout") is not None:
+                timeout = float(nodeConfiguration["timeout"])
+            async with semaphore:
+                span = startSpan("orchestrator.node")
+                if span is not None:
+                    span.setAttribute("node", nodeName)
+                    span.setAttribute("type", nodeType)
+                try:
+                    try:
+                        result = await asyncio.wait_for(self._callCachedHandler(handler, context, stream, plan, span), timeout)
+                    except asyncio.TimeoutError:
+                        raise NodeExecutionError(nodeName, "Timed out after " + str(timeout) + " seconds") from None
+                    except (NodeExecutionError, asyncio.CancelledError):
+                        raise
+                    except Exception as e:
+                        raise NodeExecutionError(nodeName, str(e)) from e
+                except BaseException as e:
+                    endSpan(span, e)
+                    raise
+                endSpan(span)
+        except BaseException as e:
+            stream.fail(e)
+            raise
+        stream.close()
+        return result
+
+    async def _execute(self, plan : FlowPlan, scope : VariableScope, streams : Union[dict, None] = None, onNodeStarted = None, nodes : Union[set, None] = None):
+        """
+        Runs the nodes of the plan, onNodeStarted(nodeName, stream) is called when a node is started.
+        If nodes is given only these nodes run, the outputs of all other nodes must already be set in the scope.
+        """
+        nodeNames = plan.getNodes() if nodes is None else [x for x in plan.getNodes() if x in nodes]
+        for nodeName in nodeNames:
+            if self.getNodeHandler(plan.getNodeType(nodeName)) is None:
+                raise NodeExecutionError(nodeName, "No handler registered for node type: " + plan.getNodeType(nodeName))
+        if streams is None:
+            streams = {}
+        semaphore = asyncio.Semaphore(self._maxConcurrency)
+        # nodes with streaming inputs wait for their dependencies to start, all other nodes for them to finish
+        pending = {}
+        for nodeName in nodeNames:
+            pending[nodeName] = set()
+            for dependency in plan.getDependencies(nodeName):
+                if nodes is None or dependency in nodes:
+                    pending[nodeName].add(dependency)
+                elif dependency not in streams:
+                    # a dependency that does not run again is replayed from its previous output
+                    stream = NodeStream()
+                    stream.append(scope.getVariableValue("nodes." + str(dependency) + ".output"))
+                    stream.close()
+                    streams[dependency] = stream
+        running = {}
+        def _start(nodeName):
+            del pending[nodeName]
+            streams[nodeName] = NodeStream()
+            running[asyncio.ensure_future(self._runNode(nodeName, plan, scope, semaphore, streams))] = nodeName
+            if onNodeStarted is not None:
+                onNodeStarted(nodeName, streams[nodeName])
+            for dependent in plan.getDependents(nodeName):
+                if dependent in pending and self._hasStreamingInputs(plan, dependent):
+                    pending[dependent].discard(nodeName)
+                    if len(pending[dependent]) == 0:
+                        _start(dependent)
+        for nodeName in [x for x in pending if len(pending[x]) == 0]:
+            if nodeName in pending:
+                _start(nodeName)
+        try:
+            while running:
+                done, _ = await asyncio.wait(list(running), return_when = asyncio.FIRST_COMPLETED)
+                for task in done:
+                    nodeName = running.pop(task)
+                    scope.setVariable("nodes." + str(nodeName) + ".output", task.result())
+                    for dependent in plan.getDependents(nodeName):
+                        if dependent in pending:
+                            pending[dependent].discard(nodeName)
+                            if len(pending[dependent]) == 0:
+                                _start(dependent)
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions = True)
+
+    async def runAsync(self, inputs : Union[dict, None] = None, priority : int = 0, deadline : Union[float, None] = None) -> dict:
+        """
+        Runs the flow with the given inputs and returns the flow outputs.
+        If a scheduler is set, the run waits for its admission by priority and deadline (a time.monotonic() timestamp)
+        and raises AdmissionRejectedError if it is not admitted.
+        """
+        plan = self.getPlan()
+        scope = self.createScope(inputs)
+        ticket = await self._admit(priority, deadline)
+        try:
+            await self._execute(plan, scope)
+        finally:
+            self._release(ticket)
+        return copy.deepcopy(scope.getNativeConfiguration("outputs"))
+
+    async def streamAsync(self, inputs : Union[dict, None] = None, priority : int = 0, deadline : Union[float, None] = None):
+        """
+        Runs the flow and yields its output incrementally.
+        Outputs that are the whole output of a node are yielded chunk by chunk as {"output": name, "chunk": chunk}
+        while the node produces them, the last item is {"outputs": outputs} with all flow outputs.
+        The run is admitted like in runAsync().
+        """
+        plan = self.getPlan()
+        scope = self.createScope(inputs)
+        ticket = await self._admit(priority, deadline)
+        try:
+            async for event in self._streamExecution(plan, scope):
+                yield event
+        finally:
+            self._release(ticket)
+
+    async def _streamExecution(self, plan : FlowPlan, scope : VariableScope, nodes : Union[set, None] = None):
+        streamedOutputs = plan.getStreamedOutputs()
+        queue = asyncio.Queue()
+        forwarders = []
+        async def _forward(outputName : str, stream : NodeStream):
+            try:
+                async for chunk in stream:
+                    await queue.put({"output": outputName, "chunk": chunk})
+            except Exception:
+                pass # the failure is raised by the execution
+        def _onNodeStarted(nodeName : str, stream : NodeStream):
+            for outputName in streamedOutputs:
+                if streamedOutputs[outputName] == nodeName:
+                    forwarders.append(asyncio.ensure_future(_forward(outputName, stream)))
+        execution = asyncio.ensure_future(self._execute(plan, scope, None, _onNodeStarted, nodes))
+        try:
+            while True:
+                nextItem = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait([nextItem, execution], return_when = asyncio.FIRST_COMPLETED)
+                if nextItem in done:
+                    yield nextItem.result()
+                    continue
+                nextItem.cancel()
+                break
+            execution.result()
+            await asyncio.gather(*forwarders)
+            while not queue.empty():
+                yield queue.get_nowait()
+            yield {"outputs": copy.deepcopy(scope.getNativeConfiguration("outputs"))}
+        finally:
+            for task in forwarders + [execution]:
+                task.cancel()
+            await asyncio.gather(*forwarders, execution, return_exceptions = True)
+
+    def run(self, inputs : Union[dict, None] = None) -> dict:
+        """
+        Runs the flow on a new event loop, use runAsync() if an event loop is already running.
+        """
+        return asyncio.run(self.runAsync(inputs))
+
+    def createSession(self) -> "FlowSession":
+        """
+        Creates a session for a multi-turn conversation, that only re-runs the nodes affected by changed inputs.
+        """
+        # imported here, the session module imports this one
+        from .flow_session import FlowSession
+        return FlowSession(self)
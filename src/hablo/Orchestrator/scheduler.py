@@ -0,0 +1,274 @@
+import asyncio, bisect, itertools, threading, time
+from typing import Union
+from ..Config import RootConfiguration
+
+
+class AdmissionRejectedError(RuntimeError):
+    """
+    Raised when a flow run is not admitted, because its queue is full or its deadline passed.
+    """
+    def __init__(self, message : str, retryAfter : Union[float, None] = None):
+        super().__init__(message)
+        self._retryAfter = retryAfter
+
+    def getRetryAfter(self) -> Union[float, None]:
+        """
+        Returns the seconds after which the client should retry or None if retrying does not help.
+        """
+        return self._retryAfter
+
+
+class AdmissionTicket:
+    """
+    The admission of a flow run, release it with AdmissionScheduler.release() when the run finished.
+    """
+    __slots__ = ("flow", "priority", "deadline", "_released")
+
+    def __init__(self, flow : str, priority : int, deadline : Union[float, None]):
+        self.flow = flow
+        self.priority = priority
+        self.deadline = deadline
+        self._released = False
+
+
+class _Waiter:
+    __slots__ = ("ticket", "loop", "future", "sortKey")
+
+    def __init__(self, ticket : AdmissionTicket, loop : asyncio.AbstractEventLoop, future : asyncio.Future, sortKey : tuple):
+        self.ticket = ticket
+        self.loop = loop
+        self.future = future
+        self.sortKey = sortKey
+
+    def __lt__(self, other : "_Waiter") -> bool:
+        return self.sortKey < other.sortKey
+
+
+class AdmissionScheduler:
+    """
+    Limits the flow runs executing at the same time and queues the runs, that exceed the limits.
+    Runs are admitted by priority (higher first), then by deadline (earlier first), then in arrival order,
+    a queued run, whose flow or priority is at its limit, does not block the runs behind it.
+    Runs whose deadline passed while they were queued are dropped, runs arriving at a full queue are rejected at once.
+    Deadlines are time.monotonic() timestamps. The scheduler is thread-safe and can be shared by the event loops of several threads.
+    """
+
+    def __init__(self, maxConcurrency : int = 64, maxQueueSize : int = 256, flowLimits : Union[dict, None] = None, priorityLimits : Union[dict, None] = None, retryAfter : float = 1.0):
+        """
+        flowLimits maps flow names to their maximum of concurrent runs,
+        priorityLimits maps priorities to {"maxConcurrency": n, "maxQueueSize": n} and
+        retryAfter is the number of seconds rejected clients are asked to wait.
+        """
+        if maxConcurrency < 1:
+            raise ValueError("maxConcurrency must be at least 1")
+        if maxQueueSize < 0:
+            raise ValueError("maxQueueSize must not be negative")
+        self._maxConcurrency = int(maxConcurrency)
+        self._maxQueueSize = int(maxQueueSize)
+        self._flowLimits = {}
+        for flow, limit in (flowLimits or {}).items():
+            self._flowLimits[str(flow)] = int(limit)
+        self._priorityConcurrency = {}
+        self._priorityQueueSize = {}
+        for priority, limits in (priorityLimits or {}).items():
+            if "maxConcurrency" in limits:
+                self._priorityConcurrency[int(priority)] = int(limits["maxConcurrency"])
+            if "maxQueueSize" in limits:
+                self._priorityQueueSize[int(priority)] = int(limits["maxQueueSize"])
+        self._retryAfter = float(retryAfter)
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+        self._waiters = []
+        self._running = 0
+        self._runningFlows = {}
+        self._runningPriorities = {}
+        self._queuedPriorities = {}
+        self._admitted = 0
+        self._rejected = 0
+        self._expired = 0
+
+    @staticmethod
+    def fromConfiguration(configuration : RootConfiguration) -> Union["AdmissionScheduler", None]:
+        """
+        Creates the scheduler from the scheduler section of the configuration, returns None if there is none:
+        scheduler:
+          maxConcurrency: 32
+          maxQueueSize: 128
+          retryAfter: 1
+          flows:
+            chat: 24
+          priorities:
+            0: {maxConcurrency: 8, maxQueueSize: 32}
+        """
+        if configuration is None or not configuration.pathExists("scheduler"):
+            return None
+        settings = configuration.createScope().getNativeConfiguration("scheduler")
+        if not isinstance(settings, dict):
+            raise ValueError("The scheduler configuration must be a dictionary")
+        flowLimits = {}
+        for flow, limit in (settings.get("flows") or {}).items():
+            flowLimits[flow] = limit["maxConcurrency"] if isinstance(limit, dict) else limit
+        return AdmissionScheduler(
+            maxConcurrency = int(settings.get("maxConcurrency", 64)),
+            maxQueueSize = int(settings.get("maxQueueSize", 256)),
+            flowLimits = flowLimits,
+            priorityLimits = settings.get("priorities") or {},
+            retryAfter = float(settings.get("retryAfter", 1.0))
+        )
+
+    def getRetryAfter(self) -> float:
+        return self._retryAfter
+
+    def getStatistics(self) -> dict:
+        with self._lock:
+            return {
+                "running": self._running,
+                "queued": len(self._waiters),
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "expired": self._expired
+            }
+
+    def _canRun(self, ticket : AdmissionTicket) -> bool:
+        if self._running >= self._maxConcurrency:
+            return False
+        if ticket.flow in self._flowLimits and self._runningFlows.get(ticket.flow, 0) >= self._flowLimits[ticket.flow]:
+            return False
+        if ticket.priority in self._priorityConcurrency and self._runningPriorities.get(ticket.priority, 0) >= self._priorityConcurrency[ticket.priority]:
+            return False
+        return True
+
+    def _start(self, ticket : AdmissionTicket):
+        self._running += 1
+        self._runningFlows[ticket.flow] = self._runningFlows.get(ticket.flow, 0) + 1
+        self._runningPriorities[ticket.priority] = self._runningPriorities.get(ticket.priority, 0) + 1
+        self._admitted += 1
+
+    def _removeWaiter(self, index : int) -> _Waiter:
+        waiter = self._waiters.pop(index)
+        self._queuedPriorities[waiter.ticket.priority] -= 1
+        return waiter
+
+    def _dispatch(self) -> list:
+        """
+        Admits the queued runs, that fit the limits, and drops the expired ones.
+        Returns the (waiter, result) pairs to deliver once the lock is released.
+        """
+        deliveries = []
+        now = time.monotonic()
+        i = 0
+        while i < len(self._waiters) and self._running < self._maxConcurrency:
+            waiter = self._waiters[i]
+            if waiter.ticket.deadline is not None and waiter.ticket.deadline <= now:
+                self._removeWaiter(i)
+                self._expired += 1
+                deliveries.append((waiter, AdmissionRejectedError("The deadline passed while the request was queued")))
+            elif self._canRun(waiter.ticket):
+                self._removeWaiter(i)
+                self._start(waiter.ticket)
+                deliveries.append((waiter, waiter.ticket))
+            else:
+                i += 1
+        return deliveries
+
+    def _deliver(self, deliveries : list):
+        for waiter, result in deliveries:
+            waiter.loop.call_soon_threadsafe(self._resolveWaiter, waiter, result)
+
+    def _resolveWaiter(self, waiter : _Waiter, result):
+        if waiter.future.done():
+            # the waiter gave up in the meantime, so its admission is passed on
+            if isinstance(result, AdmissionTicket):
+                self.release(result)
+        elif isinstance(result, BaseException):
+            waiter.future.set_exception(result)
+        else:
+            waiter.future.set_result(result)
+
+    async def acquire(self, flow : str = "default", priority : int = 0, deadline : Union[float, None] = None) -> AdmissionTicket:
+        """
+        Waits until the run is admitted and returns its ticket.
+        Raises AdmissionRejectedError if the queue is full or the deadline passes before the run is admitted.
+        """
+        ticket = AdmissionTicket(str(flow), int(priority), deadline)
+        if deadline is not None and deadline <= time.monotonic():
+            with self._lock:
+                self._rejected += 1
+            raise AdmissionRejectedError("The deadline of the request already passed")
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if not self._waiters and self._canRun(ticket):
+                self._start(ticket)
+                return ticket
+            if len(self._waiters) >= self._maxQueueSize:
+                self._rejected += 1
+                raise AdmissionRejectedError("The request queue is full", self._retryAfter)
+            if ticket.priority in self._priorityQueueSize and self._queuedPriorities.get(ticket.priority, 0) >= self._priorityQueueSize[ticket.priority]:
+                self._rejected += 1
+                raise AdmissionRejectedError("The request queue of priority " + str(ticket.priority) + " is full", self._retryAfter)
+            sortKey = (-ticket.priority, deadline if deadline is not None else float("inf"), next(self._sequence))
+            waiter = _Waiter(ticket, loop, loop.create_future(), sortKey)
+            bisect.insort(self._waiters, waiter)
+            self._queuedPriorities[ticket.priority] = self._queuedPriorities.get(ticket.priority, 0) + 1
+            deliveries = self._dispatch()
+        self._deliver(deliveries)
+        try:
+            if deadline is None:
+                return await waiter.future
+            return await asyncio.wait_for(asyncio.shield(waiter.future), max(0.0, deadline - time.monotonic()))
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._removeWaiter(self._waiters.index(waiter))
+                    if isinstance(e, asyncio.TimeoutError):
+                        self._expired += 1
+                waiter.future.cancel()
+            if waiter.future.cancelled():
+                if isinstance(e, asyncio.TimeoutError):
+                    raise AdmissionRejectedError("The deadline passed while the request was queued") from None
+                raise
+            # admitted at the same time
+            if waiter.future.exception() is not None:
+                raise waiter.future.exception() from None
+            if isinstance(e, asyncio.TimeoutError):
+                return waiter.future.result()
+            self.release(waiter.future.result())
+            raise
+
+    def release(self, ticket : AdmissionTicket):
+        """
+        Ends the admission of a run, so the next queued runs can start.
+        """
+        with self._lock:
+            if ticket._released:
+                return
+            ticket._released = True
+            self._running -= 1
+            self._runningFlows[ticket.flow] -= 1
+            self._runningPriorities[ticket.priority] -= 1
+            deliveries = self._dispatch()
+        self._deliver(deliveries)
+
+    def admit(self, flow : str = "default", priority : int = 0, deadline : Union[float, None] = None) -> "_Admission":
+        """
+        Returns an async context manager, that holds the admission of a run while its block executes:
+        async with scheduler.admit("chat", priority = 1): ...
+        """
+        return _Admission(self, flow, priority, deadline)
+
+
+class _Admission:
+    def __init__(self, scheduler : AdmissionScheduler, flow : str, priority : int, deadline : Union[float, None]):
+        self._scheduler = scheduler
+        self._flow = flow
+        self._priority = priority
+        self._deadline = deadline
+        self._ticket = None
+
+    async def __aenter__(self) -> AdmissionTicket:
+        self._ticket = await self._scheduler.acquire(self._flow, self._priority, self._deadline)
+        return self._ticket
+
+    async def __aexit__(self, excType, excValue, traceback):
+        self._scheduler.release(self._ticket)
+        return False
@@ -0,0 +1,4 @@
+from .template_base import NodeTemplates, getNodeTemplates, getTemplateReferences, getTemplateSegments, getBytecodeCache, setBytecodeCache
+
+
+__all__ = ['NodeTemplates', 'getNodeTemplates', 'getTemplateReferences', 'getTemplateSegments', 'getBytecodeCache', 'setBytecodeCache']
@@ -0,0 +1,193 @@
+import os, logging, threading, weakref
+from typing import Union
+import jinja2
+from ..Config import RootConfiguration, VariableScope, ConfigurationValueError
+from ..Config.config_base import VariableResolver
+from ..Config.config_cache import getDefaultCacheDir
+
+
+habloLogger = logging.getLogger("hablo.Templates")
+
+
+def _getNodePath(node) -> Union[tuple, None]:
+    """
+    Returns the keys of a chain like nodes.search.output or inputs["question"], or None for other expressions.
+    """
+    keys = []
+    while True:
+        if isinstance(node, jinja2.nodes.Name):
+            keys.append(node.name)
+            return tuple(reversed(keys))
+        if isinstance(node, jinja2.nodes.Getattr):
+            keys.append(node.attr)
+        elif isinstance(node, jinja2.nodes.Getitem) and isinstance(node.arg, jinja2.nodes.Const):
+            keys.append(str(node.arg.value))
+        else:
+            return None
+        node = node.node
+
+def getTemplateReferences(source : str, templateName : str = "template") -> set:
+    """
+    Returns the dotted variable paths a template reads, e.g. {"inputs.question", "nodes.search.output"}.
+    Paths are as long as the template spells them out, {{ nodes.search }} yields "nodes.search".
+    """
+    try:
+        ast = jinja2.Environment().parse(source)
+    except jinja2.TemplateSyntaxError as e:
+        raise ConfigurationValueError("Invalid template in " + templateName + " (line " + str(e.lineno) + "): " + str(e.message)) from None
+    chains = list(ast.find_all((jinja2.nodes.Getattr, jinja2.nodes.Getitem)))
+    # the inner links of a chain (nodes.a in nodes.a.output) are not references of their own
+    inner = set([id(node.node) for node in chains])
+    references = set()
+    for node in chains:
+        if id(node) not in inner:
+            path = _getNodePath(node)
+            if path is not None:
+                references.add(".".join(path))
+    for node in ast.find_all(jinja2.nodes.Name):
+        if node.ctx == "load" and id(node) not in inner:
+            references.add(node.name)
+    return references
+
+def getTemplateSegments(source : str, templateName : str = "template") -> Union[list, None]:
+    """
+    Splits a template, that only outputs text and variables like {{ nodes.search.output }}, into (text, None) and (None, path) segments.
+    Returns None for templates with any other expression, filter or statement, they can only be rendered as a whole.
+    """
+    try:
+        ast = jinja2.Environment(keep_trailing_newline = True).parse(source)
+    except jinja2.TemplateSyntaxError as e:
+        raise ConfigurationValueError("Invalid template in " + templateName + " (line " + str(e.lineno) + "): " + str(e.message)) from None
+    segments = []
+    for node in ast.body:
+        if not isinstance(node, jinja2.nodes.Output):
+            return None
+        for child in node.nodes:
+            if isinstance(child, jinja2.nodes.TemplateData):
+                segments.append((child.data, None))
+                continue
+            path = _getNodePath(child)
+            if path is None:
+                return None
+            segments.append((None, ".".join(path)))
+    return segments
+
+
+class NodeTemplates:
+    """
+    Holds the compiled "template" settings of all nodes of a loaded configuration.
+    The templates are compiled once and rendered with the values of the variables in a request scope,
+    e.g. {{ inputs.question }} or {{ nodes.search.output }}.
+    """
+
+    def __init__(self, configData, resolver : Union[VariableResolver, None], bytecodeCache : Union[jinja2.BytecodeCache, None] = None):
+        sources = {}
+        nodes = configData.get("nodes") if isinstance(configData, dict) else None
+        if isinstance(nodes, dict):
+            for name, node in nodes.items():
+                if isinstance(node, dict) and isinstance(node.get("template"), str):
+                    sources[self._getTemplateName(name)] = node["template"]
+        self._environment = jinja2.Environment(
+            loader = jinja2.DictLoader(sources),
+            bytecode_cache = bytecodeCache,
+            autoescape = False,
+            auto_reload = False,
+            keep_trailing_newline = True
+        )
+        self._templates = {}
+        for templateName in sources:
+            try:
+                self._templates[templateName] = self._environment.get_template(templateName)
+            except jinja2.TemplateSyntaxError as e:
+                raise ConfigurationValueError("Invalid template in " + templateName + " (line " + str(e.lineno) + "): " + str(e.message)) from None
+        # the context is built from the variables directly, the configuration is never dumped for rendering
+        self._variables = []
+        if resolver is not None:
+            for variable in resolver.getVariables():
+                keys = tuple(variable.getName().split("."))
+                self._variables.append((variable.getName(), keys[:-1], keys[-1]))
+
+    @staticmethod
+    def _getTemplateName(nodeName) -> str:
+        return "nodes." + str(nodeName) + ".template"
+
+    def hasTemplate(self, nodeName : str) -> bool:
+        return self._getTemplateName(nodeName) in self._templates
+
+    def getContext(self, scope : VariableScope) -> dict:
+        """
+        Returns the template context with the values of all variables in the scope.
+        """
+        context = {}
+        for variableName, parentKeys, key in self._variables:
+            target = context
+            for parentKey in parentKeys:
+                child = target.get(parentKey)
+                if not isinstance(child, dict):
+                    child = {}
+                    target[parentKey] = child
+                target = child
+            target[key] = scope.getVariableValue(variableName)
+        return context
+
+    def render(self, nodeName : str, scope : VariableScope, extraContext : Union[dict, None] = None) -> str:
+        template = self._templates.get(self._getTemplateName(nodeName))
+        if template is None:
+            raise ConfigurationValueError("No template found for node: " + str(nodeName))
+        context = self.getContext(scope)
+        if extraContext is not None:
+            context.update(extraContext)
+        return template.render(context)
+
+
+_bytecodeCache = None
+_bytecodeCacheLock = threading.Lock()
+def setBytecodeCache(bytecodeCache : Union[jinja2.BytecodeCache, None]):
+    """
+    Sets the bytecode cache used for templates compiled afterwards, None disables it.
+    """
+    global _bytecodeCache
+    with _bytecodeCacheLock:
+        _bytecodeCache = bytecodeCache if bytecodeCache is not None else False
+
+def getBytecodeCache() -> Union[jinja2.BytecodeCache, None]:
+    """
+    Returns the bytecode cache, by default a FileSystemBytecodeCache in the templates folder of the hablo cache directory.
+    Workers loading a configuration whose templates were compiled before skip the compilation.
+    """
+    global _bytecodeCache
+    with _bytecodeCacheLock:
+        if _bytecodeCache is None:
+            directory = os.path.join(getDefaultCacheDir(), "templates")
+            try:
+                os.makedirs(directory, exist_ok = True)
+                _bytecodeCache = jinja2.FileSystemBytecodeCache(directory)
+            except OSError:
+                habloLogger.warning("Cannot create the template bytecode cache, templates are compiled without it: " + directory)
+                _bytecodeCache = False
+        return _bytecodeCache if _bytecodeCache is not False else None
+
+
+_nodeTemplates = weakref.WeakKeyDictionary()
+_nodeTemplatesLock = threading.Lock()
+def _getNodeTemplates(configData, resolver : Union[VariableResolver, None]) -> NodeTemplates:
+    if resolver is None:
+        return NodeTemplates(configData, resolver, getBytecodeCache())
+    with _nodeTemplatesLock:
+        entry = _nodeTemplates.get(resolver)
+    if entry is not None and entry[0] is configData:
+        return entry[1]
+    templates = NodeTemplates(configData, resolver, getBytecodeCache())
+    with _nodeTemplatesLock:
+        _nodeTemplates[resolver] = (configData, templates)
+    return templates
+
+def getNodeTemplates(configuration : Union[RootConfiguration, VariableScope]) -> NodeTemplates:
+    """
+    Returns the compiled node templates of the currently loaded configuration or of the configuration a scope belongs to.
+    The templates are compiled once per configuration load and shared afterwards.
+    """
+    if isinstance(configuration, VariableScope):
+        return _getNodeTemplates(configuration.getConfiguration(), configuration.getVariableResolver())
+    configData, resolver = configuration._getState()
+    return _getNodeTemplates(configData, resolver)
@@ -1,19 +1,45 @@
-from .Channels import Channel, GunicornChannel
-from .Config import RootConfiguration, FileConfiguration
-from typing import Union
+__version__ = "0.0.1"
+
+import importlib
+
+# the subpackages and the names exported here are imported on first access,
+# so "import hablo" does not load yaml, asyncio or jinja2
+_subpackages = ("Channels", "Config", "Instrumentation", "Orchestrator", "Templates")
+_exports = {
+    "Channel": "Channels",
+    "GunicornChannel": "Channels",
+    "ConsoleChannel": "Channels",
+    "RootConfiguration": "Config",
+    "FileConfiguration": "Config"
+}
+
+def __getattr__(name : str):
+    if name in _subpackages:
+        return importlib.import_module("." + name, __name__)
+    if name in _exports:
+        value = getattr(importlib.import_module("." + _exports[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module " + repr(__name__) + " has no attribute " + repr(name))
+
+def __dir__():
+    return sorted(list(globals()) + list(_subpackages) + list(_exports))
 
 
 
 def mucho(
-    con : Channel = GunicornChannel(),
-    configuration : Union[RootConfiguration, None] = None
+    con : "Channel" = None,
+    configuration : "RootConfiguration" = None
 ):
     """
     Main Unified Chat-Host Orchestration (MUCHO) function
     This is the main entry point for the hablo library
     usage: hablo.mucho(con=Channel)
+    The channel defaults to a GunicornChannel and the configuration to hablo.yaml.
     """
-    if configuration is not None:
-        configuration = FileConfiguration(configpath="hablo.yaml")
+    if con is None:
+        con = __getattr__("GunicornChannel")()
+    if configuration is None:
+        configuration = __getattr__("FileConfiguration")(configpath="hablo.yaml")
     con.setConfiguration(configuration)
-
+    con.run()